@@ -0,0 +1,37 @@
+import os
+from collections import namedtuple
+
+import changefeed
+import db
+from cache import TTLCache, MISSING
+
+AccountSnapshot = namedtuple('AccountSnapshot', [
+    'user_id', 'language', 'address', 'balance', 'kyc_name', 'kyc_dob', 'kyc_id_number', 'kyc_status',
+    'kyc_attempts', 'kyc_edited',
+])
+
+# Every write to users or kyc_info publishes a 'user' change, or a 'balance' change when only the balance moved;
+# either drops the snapshot in all processes
+_snapshots = TTLCache(maxsize=int(os.getenv('USER_CACHE_SIZE', '10000')),
+                      ttl=float(os.getenv('USER_CACHE_TTL', '300')))
+changefeed.register('user', _snapshots)
+changefeed.register('balance', _snapshots)
+
+
+async def get_snapshot(user_id):
+    # Profile, balance and KYC state in one query; None if the user is not registered
+    user_id = str(user_id)
+    snapshot = _snapshots.get(user_id, MISSING)
+    if snapshot is not MISSING:
+        return snapshot
+    since = _snapshots.clock
+    row = await db.fetchone('''
+    SELECT u.user_id, u.language, u.address, u.balance, k.name, k.dob, k.id_number, k.status,
+           COALESCE(k.attempts, 0), COALESCE(k.edited, 0)
+    FROM users u LEFT JOIN kyc_info k ON k.user_id = u.user_id
+    WHERE u.user_id = ?
+    ''', (user_id,))
+    snapshot = AccountSnapshot(*row) if row else None
+    # A write to this user that committed while the query ran may not be reflected, so it is not cached then
+    _snapshots.set(user_id, snapshot, since)
+    return snapshot
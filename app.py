@@ -1,10 +1,22 @@
+import startup  # loads .env before the modules below read their settings
 from flask import Flask, request, jsonify, redirect
-import requests
 import os
+import db
+import kyc
+import kyc_storage
+import webhooks
 
 app = Flask(__name__)
+# Whole request body, so two ID scans at the per-file limit plus the form fields; larger requests get a 413
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_KYC_UPLOAD_SIZE',
+                                                 str(2 * kyc_storage.MAX_KYC_FILE_SIZE + 64 * 1024)))
 
-DISCORD_WEBHOOK_URL = 'https://discord.com/api/webhooks/YOUR_WEBHOOK_ID/YOUR_WEBHOOK_TOKEN'
+DISCORD_WEBHOOK_URL = os.getenv('DISCORD_WEBHOOK_URL',
+                                'https://discord.com/api/webhooks/YOUR_WEBHOOK_ID/YOUR_WEBHOOK_TOKEN')
+
+db.init_db()
+# Webhook calls are queued in the database and delivered by a background thread
+webhooks.start_worker()
 
 @app.route('/')
 def home():
@@ -26,8 +38,9 @@ def register():
         # Save the user details to the database
         return redirect('/kyc')
 
-@app.route('/kyc', methods=['GET', 'POST'])
-def kyc():
+# Named so the view does not shadow the kyc module it queues uploads with
+@app.route('/kyc', methods=['GET', 'POST'], endpoint='kyc')
+def kyc_form():
     if request.method == 'GET':
         return '''
             <form action="/kyc" method="post" enctype="multipart/form-data">
@@ -45,20 +58,37 @@ def kyc():
         first_name = request.form['first_name']
         last_name = request.form['last_name']
         dob = request.form['dob']
-        file1 = request.files['file1']
-        file2 = request.files['file2']
 
-        # Save files and KYC details to the database
-        # Send the KYC details to the Discord bot
+        # Werkzeug spools large parts to a temporary file, and store_file copies them on in chunks
+        stored = []
+        for field in ('file1', 'file2'):
+            upload = request.files[field]
+            extension = kyc_storage.sniff_extension(upload.stream.read(16))
+            if extension is None:
+                return f"{field} must be a PNG or JPEG image.", 400
+            upload.stream.seek(0)
+            try:
+                stored.append(kyc_storage.store_file(upload.stream, extension))
+            except kyc_storage.FileTooLarge:
+                return f"{field} is too large.", 413
+
+        # The bot posts queued uploads to the moderators' KYC channel
+        with db.connection() as conn:
+            upload_id = kyc.queue_upload(conn, country, first_name, last_name, dob, *stored)
+
         data = {
+            "upload_id": str(upload_id),
             "country": country,
             "first_name": first_name,
             "last_name": last_name,
             "dob": dob,
-            "file1_url": "URL_TO_FILE1",
-            "file2_url": "URL_TO_FILE2"
+            "file1": os.path.basename(stored[0]),
+            "file2": os.path.basename(stored[1])
         }
-        requests.post(DISCORD_WEBHOOK_URL, json=data)
+        webhooks.enqueue(DISCORD_WEBHOOK_URL, {
+            "title": "KYC submission",
+            "fields": [{"name": key, "value": value or "-", "inline": True} for key, value in data.items()]
+        })
         return "KYC submitted successfully!"
 
 if __name__ == '__main__':
@@ -0,0 +1,543 @@
+import argparse
+import asyncio
+import hashlib
+import importlib
+import io
+import json
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from PIL import Image
+
+# Simulated users run through these commands in this order, each phase to completion before the next
+PHASES = ['register', 'kyc', 'buy', 'confirm_payment', 'send', 'balance', 'dashboard', 'price', 'transfer',
+          'verify_payments', 'payment_outcomes', 'deposit_reorg', 'web_kyc']
+# Phases that assert on the outcome rather than time the commands; any error they report fails the run
+CHECKS = ['payment_outcomes', 'deposit_reorg', 'web_kyc']
+# (outcome per method at the fake providers, quote statuses expected after one verification pass, whether the
+# purchase is credited); one registered user per scenario
+PAYMENT_SCENARIOS = [
+    ({'cashapp': 'paid', 'stripe': 'pending', 'paypal': 'pending'},
+     {'cashapp': 'confirmed', 'stripe': 'superseded', 'paypal': 'superseded'}, True),
+    ({'cashapp': 'pending', 'stripe': 'pending', 'paypal': 'paid'},
+     {'cashapp': 'superseded', 'stripe': 'superseded', 'paypal': 'confirmed'}, True),
+    ({'cashapp': 'failed', 'stripe': 'failed', 'paypal': 'failed'},
+     {'cashapp': 'failed', 'stripe': 'failed', 'paypal': 'failed'}, False),
+    ({'cashapp': 'pending', 'stripe': 'pending', 'paypal': 'pending'},
+     {'cashapp': 'pending', 'stripe': 'pending', 'paypal': 'pending'}, False),
+]
+TOTAL_SUPPLY = 10 ** 24
+CONTRACT_BALANCE = 5 * 10 ** 23
+# Each fake payment provider call takes this long, roughly a real API round trip
+PROVIDER_LATENCY = 0.05
+
+
+def _word(value):
+    return '0x' + format(value, '064x')
+
+
+def _rpc_result(method, params):
+    # Just enough of an Ethereum node for the price cache and the transfer pipeline
+    if method == 'eth_chainId':
+        return hex(1)
+    if method == 'eth_blockNumber':
+        return hex(int(time.time() // 12))
+    if method == 'eth_call':
+        data = params[0]['data']
+        return _word(TOTAL_SUPPLY if data.startswith('0x18160ddd') else CONTRACT_BALANCE)
+    if method == 'eth_estimateGas':
+        return hex(21000)
+    if method == 'eth_gasPrice':
+        return hex(10 ** 9)
+    if method == 'eth_getTransactionCount':
+        return '0x0'
+    if method == 'eth_sendRawTransaction':
+        return '0x' + hashlib.sha256(params[0].encode()).hexdigest()
+    if method == 'eth_getTransactionReceipt':
+        return {'transactionHash': params[0], 'status': '0x1'}
+    raise ValueError(f"Unsupported method {method}")
+
+
+class StandInNode(BaseHTTPRequestHandler):
+    # Local JSON-RPC endpoint; also serves the KYC images the fake attachments point at
+    images = {}
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        replies = []
+        for call in body if isinstance(body, list) else [body]:
+            try:
+                result = _rpc_result(call['method'], call['params'])
+                replies.append({'jsonrpc': '2.0', 'id': call['id'], 'result': result})
+            except ValueError as e:
+                replies.append({'jsonrpc': '2.0', 'id': call['id'], 'error': {'code': -32601, 'message': str(e)}})
+        self._reply(json.dumps(replies if isinstance(body, list) else replies[0]).encode(), 'application/json')
+
+    def do_GET(self):
+        image = self.images.get(self.path)
+        if image is None:
+            self.send_error(404)
+            return
+        self._reply(image, 'image/png')
+
+    def _reply(self, payload, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeChain:
+    # In-process node for the deposit indexer: block hashes change above a height once fork() replaces the chain
+    # from there, and Transfer logs live in the blocks they were mined in
+    def __init__(self, transfer_topic, head):
+        self.transfer_topic = transfer_topic
+        self.head = head
+        self.forks = []
+        self.transfers = []
+        self.ranges = []
+
+    def block_hash(self, number):
+        branch = sum(1 for height in self.forks if number >= height)
+        return '0x' + hashlib.sha256(f'{branch}:{number}'.encode()).hexdigest()
+
+    def fork(self, height):
+        self.forks.append(height)
+        self.transfers = [transfer for transfer in self.transfers if transfer[0] < height]
+
+    def transfer(self, block, sender, recipient, wei, tx_hash):
+        self.transfers.append((block, sender, recipient, wei, tx_hash))
+
+    def call(self, method, params):
+        if method == 'eth_blockNumber':
+            return hex(self.head)
+        if method == 'eth_getBlockByNumber':
+            number = int(params[0], 16)
+            return {'number': params[0], 'hash': self.block_hash(number)} if number <= self.head else None
+        if method == 'eth_getLogs':
+            start, end = int(params[0]['fromBlock'], 16), int(params[0]['toBlock'], 16)
+            self.ranges.append((start, end))
+            return [{'topics': [self.transfer_topic, '0x' + sender[2:].lower().rjust(64, '0'),
+                                '0x' + recipient[2:].lower().rjust(64, '0')],
+                     'data': hex(wei), 'transactionHash': tx_hash, 'logIndex': '0x0', 'blockNumber': hex(block),
+                     'blockHash': self.block_hash(block)}
+                    for block, sender, recipient, wei, tx_hash in self.transfers if start <= block <= end]
+        raise ValueError(f"Unsupported method {method}")
+
+
+class FakeProviders(BaseHTTPRequestHandler):
+    # Stand-in Stripe, PayPal, Cash App and Tinkoff APIs. Checkouts are created under the fake's own reference and
+    # remember the merchant's order reference (our quote_id); outcomes[quote_id] decides how each one ends
+    # ('paid', 'failed' or 'pending'), and unlisted ones are paid in full.
+    # HTTP/1.1 keeps connections open, so the verification engine's connection pool is exercised as in production.
+    protocol_version = 'HTTP/1.1'
+    outcomes = {}
+    checkouts = {}
+    lock = threading.Lock()
+
+    def _create(self, quote_id, cents):
+        with self.lock:
+            reference = f'ref{len(self.checkouts)}'
+            self.checkouts[reference] = (quote_id, cents)
+        return reference
+
+    def _outcome(self, reference):
+        quote_id, cents = self.checkouts[reference]
+        return self.outcomes.get(quote_id, 'paid'), cents
+
+    def do_GET(self):
+        time.sleep(PROVIDER_LATENCY)
+        reference = self.path.rsplit('/', 1)[-1]
+        if reference not in self.checkouts:
+            self.send_error(404)
+        elif self.path.startswith('/v1/checkout/sessions/'):
+            outcome, cents = self._outcome(reference)
+            self._reply({'id': reference, 'amount_total': cents,
+                         'payment_status': 'paid' if outcome == 'paid' else 'unpaid',
+                         'status': {'paid': 'complete', 'failed': 'expired'}.get(outcome, 'open')})
+        elif self.path.startswith('/v2/checkout/orders/'):
+            outcome, cents = self._outcome(reference)
+            self._reply({'id': reference, 'purchase_units': [{'amount': {'value': f'{cents / 100:.2f}'}}],
+                         'status': {'paid': 'APPROVED', 'failed': 'VOIDED'}.get(outcome, 'PAYER_ACTION_REQUIRED')})
+        elif self.path.startswith('/customer-request/v1/requests/'):
+            outcome, _ = self._outcome(reference)
+            self._reply({'request': {'id': reference, 'grants': [{'id': f'grant-{reference}'}],
+                                     'state': {'paid': 'APPROVED', 'failed': 'DECLINED'}.get(outcome, 'PENDING')}})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        time.sleep(PROVIDER_LATENCY)
+        raw = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path == '/v1/checkout/sessions':
+            form = parse_qs(raw.decode())
+            reference = self._create(form['client_reference_id'][0],
+                                     int(form['line_items[0][price_data][unit_amount]'][0]))
+            self._reply({'id': reference, 'url': f'https://checkout.stripe.test/{reference}'})
+        elif self.path == '/v2/checkout/orders':
+            unit = json.loads(raw)['purchase_units'][0]
+            reference = self._create(unit['invoice_id'], round(float(unit['amount']['value']) * 100))
+            self._reply({'id': reference, 'links': [{'rel': 'approve', 'href': f'https://paypal.test/{reference}'}]})
+        elif self.path.startswith('/v2/checkout/orders/') and self.path.endswith('/capture'):
+            self._reply({'status': 'COMPLETED'})
+        elif self.path == '/customer-request/v1/requests':
+            request = json.loads(raw)['request']
+            reference = self._create(request['reference_id'], request['actions'][0]['amount'])
+            self._reply({'request': {'id': reference,
+                                     'auth_flow_triggers': {'mobile_url': f'https://cash.app.test/{reference}'}}})
+        elif self.path == '/network/v1/payments':
+            self._reply({'payment': {'status': 'CAPTURED'}})
+        elif self.path == '/v2/Init':
+            body = json.loads(raw)
+            reference = self._create(body['OrderId'], body['Amount'])
+            self._reply({'Success': True, 'PaymentId': reference, 'PaymentURL': f'https://tinkoff.test/{reference}'})
+        elif self.path == '/v2/GetState':
+            outcome, cents = self._outcome(json.loads(raw)['PaymentId'])
+            self._reply({'Success': True, 'Amount': cents,
+                         'Status': {'paid': 'CONFIRMED', 'failed': 'REJECTED'}.get(outcome, 'NEW')})
+        elif self.path == '/v1/oauth2/token':
+            self._reply({'access_token': 'bench', 'expires_in': 3600})
+        elif self.path == '/webhook':
+            # Stands in for the Discord webhook the web app announces submissions on
+            self._reply({})
+        else:
+            self.send_error(404)
+
+    def _reply(self, body):
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_image(seed):
+    # Every user uploads a different picture so the content store really writes each one
+    image = Image.new('RGB', (256, 256), (seed % 256, seed // 256 % 256, 128))
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class FakeAttachment:
+    def __init__(self, filename, url, size):
+        self.filename = filename
+        self.url = url
+        self.size = size
+
+
+class FakeMessage:
+    def __init__(self, attachments=()):
+        self.attachments = list(attachments)
+
+    async def delete(self):
+        pass
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.mention = f'<@{user_id}>'
+        self.received = []
+
+    async def send(self, content=None, **kwargs):
+        self.received.append(content)
+
+
+class FakeChannel:
+    async def send(self, content=None, file=None, view=None):
+        if file is not None:
+            file.close()
+
+
+class FakeContext:
+    def __init__(self, author, message=None):
+        self.author = author
+        self.message = message or FakeMessage()
+
+    async def send(self, content=None, **kwargs):
+        await self.author.send(content, **kwargs)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def build_steps(bot, users, addresses, base_url):
+    # Returns, per phase, the coroutine factory for simulated user i
+    count = len(users)
+
+    def attachment(i):
+        path = f'/kyc/{i}.png'
+        return FakeAttachment(f'id-{i}.png', base_url + path, len(StandInNode.images[path]))
+
+    return {
+        'register': lambda i: bot.register.callback(FakeContext(users[i]), f'user{i}@example.com', 'hunter2'),
+        'kyc': lambda i: bot.kyc_command.callback(FakeContext(users[i], FakeMessage([attachment(i)])),
+                                                  'Bench User', '01/02/1990', f'ID{i:08d}'),
+        'buy': lambda i: bot.buy.callback(FakeContext(users[i]), 100.0, 'ETH'),
+        'confirm_payment': lambda i: bot.confirm_payment.callback(FakeContext(users[i]), 'stripe'),
+        'send': lambda i: bot.send.callback(FakeContext(users[i]), 1.0, users[(i + 1) % count]),
+        'balance': lambda i: bot.balance.callback(FakeContext(users[i])),
+        'dashboard': lambda i: bot.dashboard.callback(FakeContext(users[i])),
+        'price': lambda i: bot.price.callback(FakeContext(users[i])),
+        'transfer': lambda i: bot.transfer.callback(FakeContext(users[i]), 0.001, addresses[(i + 1) % count]),
+    }
+
+
+async def run_phase(step, count, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = defaultdict(int)
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await step(i)
+            except Exception as e:
+                errors[f'{type(e).__name__}: {e}'] += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    return latencies, errors, time.perf_counter() - start
+
+
+async def register_missing(bot, users):
+    # The checks also run on their own (--phases payment_outcomes), before the register phase created anyone
+    for i, user in enumerate(users):
+        if not await bot.get_user_info(user.id):
+            await bot.register.callback(FakeContext(user), f'user{i}@example.com', 'hunter2')
+
+
+async def check_payment_outcomes(bot, users):
+    # Each scenario's user buys once, the fake providers settle every quote as the scenario says, and one
+    # verification pass has to leave exactly the expected quote statuses and balance behind
+    errors = defaultdict(int)
+    if len(users) < len(PAYMENT_SCENARIOS):
+        errors[f'needs --users {len(PAYMENT_SCENARIOS)} or more, one per scenario'] += 1
+        return errors
+    await register_missing(bot, users[:len(PAYMENT_SCENARIOS)])
+    purchases = []
+    for user, (outcomes, expected, credited) in zip(users, PAYMENT_SCENARIOS):
+        user_id = str(user.id)
+        balance = await bot.wallet.get_balance(user_id)
+        await bot.buy.callback(FakeContext(user), 100.0, 'ETH')
+        purchase = await bot.db.fetchone('SELECT purchase_id FROM pending_purchases WHERE user_id = ? '
+                                         'ORDER BY created_at DESC LIMIT 1', (user_id,))
+        quotes = await bot.db.fetchall('SELECT quote_id, method FROM pending_purchases WHERE purchase_id = ?',
+                                       (purchase[0],))
+        FakeProviders.outcomes.update({quote_id: outcomes[method] for quote_id, method in quotes})
+        purchases.append((user_id, purchase[0], outcomes, expected, balance + 100.0 if credited else balance))
+    await bot.payment_engine.run_once()
+    for user_id, purchase_id, outcomes, expected, balance in purchases:
+        label = '/'.join(outcomes.values())
+        statuses = dict(await bot.db.fetchall('SELECT method, status FROM pending_purchases WHERE purchase_id = ?',
+                                              (purchase_id,)))
+        if statuses != expected:
+            errors[f'{label}: quotes ended {statuses}, expected {expected}'] += 1
+        if await bot.wallet.get_balance(user_id) != balance:
+            errors[f'{label}: balance is not {balance}'] += 1
+    return errors
+
+
+async def check_deposit_reorg(bot, users):
+    # Drives the deposit indexer through its first poll, a credited deposit, and a reorg deeper than the
+    # confirmation depth that moves the deposit to another block
+    errors = defaultdict(int)
+    indexer = bot.indexer
+    await register_missing(bot, users[:1])
+    user_id = str(users[0].id)
+    address = (await bot.db.fetchone('SELECT address FROM users WHERE user_id = ?', (user_id,)))[0]
+    sender = '0x' + '22' * 20
+    balance = await bot.wallet.get_balance(user_id)
+    chain = FakeChain(indexer.TRANSFER_TOPIC, 10 ** 6)
+    deposits = indexer.DepositIndexer(chain, '0x' + '11' * 20, confirmations=2)
+
+    await deposits.poll()
+    if chain.ranges[0][0] != chain.head - 2:
+        errors[f'first poll scanned from block {chain.ranges[0][0]}, not the confirmed head'] += 1
+
+    chain.transfer(chain.head + 1, sender, address, 5 * 10 ** 18, '0x' + 'ab' * 32)
+    chain.head += 5
+    await deposits.poll()
+    if await bot.wallet.get_balance(user_id) != balance + 5:
+        errors['deposit was not credited'] += 1
+
+    # Every block from the deposit's on is replaced; the same transaction is mined again one block later
+    deposit_block = chain.head - 4
+    chain.fork(deposit_block)
+    chain.transfer(deposit_block + 1, sender, address, 5 * 10 ** 18, '0x' + 'ab' * 32)
+    chain.head += 1
+    checkpoint = (await bot.db.fetchone('SELECT block FROM chain_checkpoints WHERE name = ?',
+                                        (indexer.CHECKPOINT,)))[0]
+    chain.ranges.clear()
+    await deposits.poll()
+    if min(start for start, _ in chain.ranges) < checkpoint - indexer.MAX_REWIND:
+        errors['rewind went further back than MAX_REWIND'] += 1
+    if await bot.wallet.get_balance(user_id) != balance + 5:
+        errors['deposit was lost or credited twice across the reorg'] += 1
+    rows = await bot.db.fetchall('SELECT block_number FROM chain_deposits WHERE user_id = ?', (user_id,))
+    if rows != [(deposit_block + 1,)]:
+        errors[f'deposits recorded at blocks {rows}, expected {deposit_block + 1}'] += 1
+    reversals = await bot.db.fetchall("SELECT amount FROM ledger_entries WHERE user_id = ? AND kind = "
+                                      "'deposit_reversal'", (user_id,))
+    if reversals != [(-5.0,)]:
+        errors[f'reversals {reversals}, expected one of -5'] += 1
+    return errors
+
+
+async def check_web_kyc(bot, users):
+    # Submits the web app's KYC form as a real multipart body; the upload has to be queued for the bot to post
+    errors = defaultdict(int)
+    app = importlib.import_module('app')
+    last = (await bot.db.fetchone('SELECT COALESCE(MAX(upload_id), 0) FROM kyc_uploads'))[0]
+    response = app.app.test_client().post('/kyc', content_type='multipart/form-data', data={
+        'country': 'DE', 'first_name': 'Web', 'last_name': 'User', 'dob': '1990-02-01',
+        'file1': (io.BytesIO(make_image(1)), 'front.png'), 'file2': (io.BytesIO(make_image(2)), 'back.png'),
+    })
+    if response.status_code != 200:
+        errors[f'POST /kyc answered {response.status_code}'] += 1
+    rows = await bot.db.fetchall('SELECT first_name, last_name, status FROM kyc_uploads WHERE upload_id > ?', (last,))
+    if rows != [('Web', 'User', 'queued')]:
+        errors[f'kyc_uploads rows {rows}, expected one queued upload'] += 1
+    return errors
+
+
+async def run(bot, users, base_url, concurrency, phases):
+    addresses = []
+    steps = build_steps(bot, users, addresses, base_url)
+    results = []
+    for phase in phases:
+        if phase == 'verify_payments':
+            # Everyone buys again, then one background pass has to confirm all of those quotes
+            await run_phase(steps['buy'], len(users), concurrency)
+            start = time.perf_counter()
+            confirmed = await bot.payment_engine.run_once()
+            elapsed = time.perf_counter() - start
+            errors = {'quote left unconfirmed': len(users) - len(confirmed)} if len(confirmed) < len(users) else {}
+            results.append((phase, [elapsed / len(users)] * len(users), errors, elapsed))
+            continue
+        if phase in CHECKS:
+            start = time.perf_counter()
+            check = {'payment_outcomes': check_payment_outcomes, 'deposit_reorg': check_deposit_reorg,
+                     'web_kyc': check_web_kyc}[phase]
+            errors = await check(bot, users)
+            elapsed = time.perf_counter() - start
+            results.append((phase, [elapsed], errors, elapsed))
+            continue
+        if phase == 'transfer':
+            # Transfers go to the other simulated users' wallets, known once they registered
+            by_id = dict(await bot.db.fetchall('SELECT user_id, address FROM users'))
+            addresses[:] = [by_id[str(user.id)] for user in users]
+        latencies, errors, elapsed = await run_phase(steps[phase], len(users), concurrency)
+        results.append((phase, latencies, errors, elapsed))
+    await bot.dm_outbox.flush()
+    return results
+
+
+def report(results):
+    lines = [f"{'command':<16}{'ops':>8}{'errors':>8}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+    for phase, latencies, errors, elapsed in results:
+        lines.append(f"{phase:<16}{len(latencies):>8}{sum(errors.values()):>8}{len(latencies) / elapsed:>10.1f}"
+                     f"{percentile(latencies, 0.50) * 1000:>10.2f}{percentile(latencies, 0.95) * 1000:>10.2f}"
+                     f"{percentile(latencies, 0.99) * 1000:>10.2f}")
+    for phase, _, errors, _ in results:
+        for message, count in errors.items():
+            lines.append(f"  {phase}: {count} x {message}")
+    all_latencies = [latency for _, latencies, _, _ in results for latency in latencies]
+    lines.append(f"mean latency {statistics.mean(all_latencies) * 1000:.2f} ms over {len(all_latencies)} calls")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Drive the bot command handlers with simulated users.')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--phases', default=','.join(PHASES), help='comma separated subset of ' + ','.join(PHASES))
+    parser.add_argument('--rpc-url', help='use a real node (e.g. npx hardhat node) instead of the built-in stand-in')
+    parser.add_argument('--output', help='also write the report to this file, e.g. bench_output.txt')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='pluex-bench-')
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInNode)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    StandInNode.images = {f'/kyc/{i}.png': make_image(i) for i in range(args.users)}
+    providers = ThreadingHTTPServer(('127.0.0.1', 0), FakeProviders)
+    threading.Thread(target=providers.serve_forever, daemon=True).start()
+    providers_url = f'http://127.0.0.1:{providers.server_port}'
+
+    # The bot reads its configuration at import time, so everything is pointed at scratch space first
+    os.environ.update({
+        'DB_PATH': os.path.join(workdir, 'pluex.db'),
+        'KYC_STORAGE_DIR': os.path.join(workdir, 'kyc_files'),
+        'ETH_NETWORK': args.rpc_url or base_url,
+        'PLUTOKEN_CONTRACT_ADDRESS': '0x' + '11' * 20,
+        'RECEIPT_POLL_INTERVAL': '0.5',
+        'STRIPE_SECRET_KEY': 'sk_bench', 'STRIPE_API_URL': providers_url,
+        'CASHAPP_CLIENT_ID': 'bench', 'CASHAPP_API_KEY': 'bench', 'CASHAPP_MERCHANT_ID': 'bench',
+        'CASHAPP_API_URL': providers_url,
+        'TINKOFF_TERMINAL_KEY': 'bench', 'TINKOFF_PASSWORD': 'bench', 'TINKOFF_API_URL': providers_url,
+        'PAYPAL_CLIENT_ID': 'bench', 'PAYPAL_SECRET': 'bench', 'PAYPAL_API_URL': providers_url,
+        'DISCORD_WEBHOOK_URL': providers_url + '/webhook',
+    })
+    bot = importlib.import_module('bot')
+    prices = importlib.import_module('prices')
+    logging.getLogger().setLevel(logging.WARNING)
+    bot.price_oracle = prices.PriceOracle(prices.StaticBackend({'ETH': 3000.0, 'BTC': 60000.0, 'XPLT': 1.0}))
+    bot.bot.get_channel = lambda channel_id: FakeChannel()
+
+    users = [FakeUser(10 ** 17 + i) for i in range(args.users)]
+    phases = [phase for phase in args.phases.split(',') if phase]
+
+    async def session():
+        try:
+            await bot.initialize()
+            return await run(bot, users, base_url, args.concurrency, phases)
+        finally:
+            bot.price_oracle.close()
+            if bot.transfer_pipeline is not None:
+                bot.transfer_pipeline.close()
+            await bot.kyc_storage.close()
+            if bot.payment_engine is not None:
+                await bot.payment_engine.close()
+
+    try:
+        results = asyncio.run(session())
+    finally:
+        server.shutdown()
+        providers.shutdown()
+        bot.db.close_all()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = report(results)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    if any(errors for phase, _, errors, _ in results if phase in CHECKS):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,41 +1,67 @@
+import startup
 import os
 import discord
-from discord.ext import commands
-from dotenv import load_dotenv
+from discord.ext import commands, tasks
 from web3 import Web3
+from eth_account import Account
 import wallet
 import kyc
 import re
-import sqlite3
+import db
+from cache import TTLCache, MISSING
 import secrets
 from datetime import datetime
-import cryptocompare
+import prices
+import chain
+import transfers
+import purchases
+import kyc_storage
+import i18n
+import ratelimit
+import outbox
+import metrics
+import changefeed
+import accounts
+import indexer
+import payments
 import logging
-
-load_dotenv()
+import math
+import asyncio
 
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix='!', intents=intents)
+
+
+# Set by launcher.py when the bot runs as several processes; each process owns a subset of the shards
+SHARD_COUNT = int(os.getenv('SHARD_COUNT')) if os.getenv('SHARD_COUNT') else None
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv('SHARD_IDS').split(',')] if os.getenv('SHARD_IDS') else None
+# Database-wide background jobs only run in the first process
+PRIMARY_PROCESS = os.getenv('PROCESS_INDEX', '0') == '0'
+
+
+class PluexBot(commands.AutoShardedBot):
+    async def setup_hook(self):
+        # Buttons on messages sent by any earlier run are handled by these classes, matched on custom_id
+        self.add_dynamic_items(KYCReviewButton, KYCEditButton, ContactSupportButton, ModeratorDashboardButton)
+        await initialize()
+
+
+bot = PluexBot(command_prefix='!', intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+metrics.instrument_discord(bot.http)
 
 MOD_ROLE_ID = 1243552926677340240
 SUPPORT_CHANNEL_ID = 1242639972163653673
 KYC_CHANNEL_ID = 1243553612005769288
 
-# Ensure the environment variable is loaded
-contract_address_str = os.getenv('PLUTOKEN_CONTRACT_ADDRESS')
-if not contract_address_str or contract_address_str == '-':
-    raise ValueError("PLUTOKEN_CONTRACT_ADDRESS environment variable not set")
-
-# Web3 setup for Ethereum-based token transactions
-w3 = Web3(Web3.HTTPProvider(os.getenv('ETH_NETWORK')))
-contract_address = w3.to_checksum_address(contract_address_str)
-with open('PluTokenABI.json', 'r') as abi_file:
-    contract_abi = abi_file.read()
-plutoken_contract = w3.eth.contract(address=contract_address, abi=contract_abi)
-
-# Set CryptoCompare API Key
-cryptocompare.cryptocompare._set_api_key_parameter(os.getenv('CRYPTOCOMPARE_API_KEY'))
+# Chain and price clients; built by initialize() once the bot starts rather than at import
+plutoken_contract = None
+rpc = None
+token_price_cache = None
+transfer_pipeline = None
+price_oracle = None
+deposit_indexer = None
+payment_engine = None
+dm_outbox = outbox.Outbox()
 
 # Define fees
 XPLT_MAKER_FEE = 0.004  # 0.4%
@@ -47,187 +73,133 @@ OTHER_TAKER_FEE = 0.012  # 1.2%
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Messages dictionary for multi-language support
-messages = {
-    'en': {
-        'missing_argument': "Error: Missing required argument: {}",
-        'invalid_command': "Invalid command. Use !commands to see the list of available commands.",
-        'already_registered': "You are already registered.",
-        'not_registered': "You must be registered to perform this action.",
-        'invalid_name': "Name must contain only letters and spaces.",
-        'invalid_dob': "DOB must be in MM/DD/YYYY format.",
-        'kyc_approved': "Your KYC is already approved. You can edit your KYC details once if needed.",
-        'kyc_attempts_exceeded': "You have exceeded the maximum number of KYC attempts. Please contact support.",
-        'kyc_attachment_required': "Please attach a .png or .jpg/.jpeg file with your KYC details.",
-        'kyc_invalid_file_type': "Invalid file type. Please upload a .png or .jpg/.jpeg file.",
-        'kyc_edited': "Your KYC details have been edited and submitted for approval.",
-        'kyc_submitted': "Your KYC details have been submitted for approval.",
-        'kyc_details': "Name: {}\nDOB: {}\nID Number: {} {}",
-        'kyc_submission': "New KYC submission from {}.\n{}",
-        'kyc_approved_msg': "Your KYC has been approved. You now have access to all privileges.",
-        'kyc_rejected_msg': "Your KYC has been rejected. You have {} attempts left.",
-        'kyc_resubmit': "You can now resubmit your KYC details using the !kyc command.",
-        'contact_support': "Please contact support in {}.",
-        'no_kyc_details': "You have not submitted any KYC details.",
-        'kyc_details_info': "Name: {}\nDOB: {}\nID Number: {}\nStatus: {}\nAttempts Left: {}",
-        'moderator_dashboard': "Moderator Dashboard",
-        'all_kyc_submissions': "All KYC submissions:\n{}",
-        'change_kyc_status': "Use !changekyc <user_id> <status> to change a user's KYC status.",
-        'invalid_status': "Invalid status. Use 'Approved', 'Rejected', or 'Pending'.",
-        'kyc_status_updated': "KYC status for user {} has been updated to {}.",
-        'invalid_channel': "This command can only be used in the designated channel.",
-        'payment_method_not_supported': "Payment method not supported.",
-        'deposit_successful': "You have successfully deposited {} PluToken.",
-        'sell_successful': "You have successfully sold {} PluToken. Transaction hash: {}",
-        'buy_successful': "You have successfully bought {} PluToken. Transaction hash: {}",
-        'request_tokens': "{} has requested {} PluToken from you. Account Number: {}",
-        'request_sent': "Requested {} PluToken from {}. Account Number: {}",
-        'send_tokens': "{} has sent you {} PluToken.",
-        'send_successful': "Sent {} PluToken to {}.",
-        'transfer_successful': "You have successfully transferred {} PluToken to address {}. Transaction hash: {}",
-        'balance_info': "Your balance is {} PluToken.",
-        'dashboard_info': "Dashboard:\nBalance: {} PluToken\nKYC Status: {}",
-        'account_deleted': "Your account has been deleted. You will need to register and submit KYC again to use the dashboard and other services.",
-        'token_price': "The current price of PluToken is {} ETH.",
-        'cashapp_payment': "Please send {} USD to {} and provide the receipt here.",
-        'unsupported_crypto': "Currently, only Ethereum-based tokens are supported.",
-        'buy_crypto_successful': "You have successfully bought {} {}. Transaction hash: {}",
-        'withdraw_successful_usd': "You have successfully withdrawn {} USD.",
-        'withdraw_successful_rub': "You have successfully withdrawn {} RUB via Tinkoff Pay."
-    },
-    'ru': {
-        'missing_argument': "Ошибка: отсутствует обязательный аргумент: {}",
-        'invalid_command': "Недопустимая команда. Используйте !commands, чтобы увидеть список доступных команд.",
-        'already_registered': "Вы уже зарегистрированы.",
-        'not_registered': "Вы должны быть зарегистрированы, чтобы выполнить это действие.",
-        'invalid_name': "Имя должно содержать только буквы и пробелы.",
-        'invalid_dob': "Дата рождения должна быть в формате ММ/ДД/ГГГГ.",
-        'kyc_approved': "Ваша KYC уже одобрена. Вы можете изменить свои данные KYC один раз при необходимости.",
-        'kyc_attempts_exceeded': "Вы превысили максимальное количество попыток KYC. Пожалуйста, свяжитесь с поддержкой.",
-        'kyc_attachment_required': "Пожалуйста, прикрепите файл .png или .jpg/.jpeg с вашими данными KYC.",
-        'kyc_invalid_file_type': "Неправильный тип файла. Пожалуйста, загрузите файл .png или .jpg/.jpeg.",
-        'kyc_edited': "Ваши данные KYC были изменены и отправлены на одобрение.",
-        'kyc_submitted': "Ваши данные KYC были отправлены на одобрение.",
-        'kyc_details': "Имя: {}\nДата рождения: {}\нНомер ID: {} {}",
-        'kyc_submission': "Новая заявка KYC от {}.\н{}",
-        'kyc_approved_msg': "Ваша KYC была одобрена. Теперь у вас есть доступ ко всем привилегиям.",
-        'kyc_rejected_msg': "Ваша KYC была отклонена. У вас осталось {} попыток.",
-        'kyc_resubmit': "Теперь вы можете повторно отправить свои данные KYC, используя команду !kyc.",
-        'contact_support': "Пожалуйста, свяжитесь с поддержкой в {}.",
-        'no_kyc_details': "Вы не отправили никаких данных KYC.",
-        'kyc_details_info': "Имя: {}\nДата рождения: {}\нНомер ID: {}\нСтатус: {}\нОсталось попыток: {}",
-        'moderator_dashboard': "Панель модератора",
-        'all_kyc_submissions': "Все заявки KYC:\н{}",
-        'change_kyc_status': "Используйте !changekyc <user_id> <status>, чтобы изменить статус KYC пользователя.",
-        'invalid_status': "Недопустимый статус. Используйте 'Approved', 'Rejected' или 'Pending'.",
-        'kyc_status_updated': "Статус KYC для пользователя {} был обновлен на {}.",
-        'invalid_channel': "Эту команду можно использовать только в указанном канале.",
-        'payment_method_not_supported': "Способ оплаты не поддерживается.",
-        'deposit_successful': "Вы успешно внесли {} PluToken.",
-        'sell_successful': "Вы успешно продали {} PluToken. Хэш транзакции: {}",
-        'buy_successful': "Вы успешно купили {} PluToken. Хэш транзакции: {}",
-        'request_tokens': "{} запрашивает у вас {} PluToken. Номер счета: {}",
-        'request_sent': "Запрошено {} PluToken у {}. Номер счета: {}",
-        'send_tokens': "{} отправил вам {} PluToken.",
-        'send_successful': "Отправлено {} PluToken {}.",
-        'transfer_successful': "Вы успешно перевели {} PluToken на адрес {}. Хэш транзакции: {}",
-        'balance_info': "Ваш баланс составляет {} PluToken.",
-        'dashboard_info': "Панель управления:\нБаланс: {} PluToken\nСтатус KYC: {}",
-        'account_deleted': "Ваш аккаунт был удален. Вам нужно будет зарегистрироваться и отправить KYC снова, чтобы использовать панель управления и другие услуги.",
-        'token_price': "Текущая цена PluToken составляет {} ETH.",
-        'cashapp_payment': "Пожалуйста, отправьте {} USD на {} и предоставьте квитанцию здесь.",
-        'unsupported_crypto': "В настоящее время поддерживаются только токены на основе Ethereum.",
-        'buy_crypto_successful': "Вы успешно купили {} {}. Хэш транзакции: {}",
-        'withdraw_successful_usd': "Вы успешно вывели {} USD.",
-        'withdraw_successful_rub': "Вы успешно вывели {} RUB через Tinkoff Pay."
-    }
-}
-
-
-def transfer_tokens(sender_private_key, recipient_address, amount):
+
+
+def load_clients():
+    global plutoken_contract, rpc, token_price_cache, transfer_pipeline, price_oracle, deposit_indexer, payment_engine
+    # Ensure the environment variable is loaded
+    contract_address_str = os.getenv('PLUTOKEN_CONTRACT_ADDRESS')
+    if not contract_address_str or contract_address_str == '-':
+        raise ValueError("PLUTOKEN_CONTRACT_ADDRESS environment variable not set")
+
+    # Web3 setup for Ethereum-based token transactions
+    w3 = Web3(Web3.HTTPProvider(os.getenv('ETH_NETWORK')))
+    contract_address = w3.to_checksum_address(contract_address_str)
+    with open('PluTokenABI.json', 'r') as abi_file:
+        contract_abi = abi_file.read()
+    plutoken_contract = w3.eth.contract(address=contract_address, abi=contract_abi)
+    rpc = chain.RPCClient(os.getenv('ETH_NETWORK'))
+    token_price_cache = chain.TokenPriceCache(rpc, plutoken_contract)
+    transfer_pipeline = transfers.TransferPipeline(rpc)
+    deposit_indexer = indexer.DepositIndexer(rpc, contract_address)
+    payment_engine = payments.VerificationEngine(payments.providers_from_env())
+
+    # Shared price quotes, backed by CryptoCompare
+    if price_oracle is None:
+        price_oracle = prices.PriceOracle(prices.CryptoCompareBackend(os.getenv('CRYPTOCOMPARE_API_KEY')))
+
+
+async def check_rpc():
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, rpc.call, 'eth_blockNumber', [])
+
+
+async def initialize():
+    # Independent set-up runs concurrently, then each dependency is probed once; a failed probe is logged
+    # but does not stop the bot, since the dependency may recover and commands report their own errors
+    boot = startup.Startup()
+    boot.mark('imports')
+    await asyncio.gather(
+        # Create or upgrade the shared database schema
+        boot.phase('database', db.init_db),
+        # Load and validate the message catalogs in locales/
+        boot.phase('messages', i18n.load),
+        boot.phase('clients', load_clients),
+    )
+    await asyncio.gather(
+        boot.check('database', lambda: db.fetchone('SELECT 1')),
+        boot.check('rpc', check_rpc),
+        boot.check('prices', lambda: price_oracle.get_price('ETH')),
+    )
+    boot.log()
+    return boot
+
+async def transfer_tokens(sender_private_key, recipient_address, amount, on_receipt=None):
     try:
-        # Fetch the current gas price from the network
-        gas_price = w3.eth.gasPrice  # Gets the current gas price in Wei
-        # Estimate gas limit for the transaction
-        gas_estimate = w3.eth.estimateGas({
-            'to': recipient_address,
-            'value': amount,
-            'from': w3.eth.account.privateKeyToAccount(sender_private_key).address
-        })
-
-        # Create a transaction
-        tx = {
-            'to': recipient_address,
-            'value': amount,
-            'gas': gas_estimate,
-            'gasPrice': gas_price,
-            'nonce': w3.eth.getTransactionCount(w3.eth.account.privateKeyToAccount(sender_private_key).address),
-            'chainId': 1
-        }
-        signed_tx = w3.eth.account.signTransaction(tx, sender_private_key)
-        tx_hash = w3.eth.sendRawTransaction(signed_tx.rawTransaction)
-        return tx_hash.hex()
+        return await transfer_pipeline.submit(sender_private_key, recipient_address, amount, on_receipt)
     except Exception as e:
         logger.error(f"Error in transfer_tokens: {str(e)}")
         return str(e)
 
 
 def generate_wallet():
-    account = w3.eth.account.create()
-    return account.address, account.privateKey.hex()
+    account = Account.create()
+    return account.address, account.key.hex()
 
 
-def store_user_info(user_id, email, password, address, private_key, recovery_code, language):
-    conn = sqlite3.connect('migrations/users.db')
-    c = conn.cursor()
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        user_id TEXT PRIMARY KEY,
-        email TEXT,
-        password TEXT,
-        address TEXT,
-        private_key TEXT,
-        recovery_code TEXT,
-        language TEXT
-    )
-    ''')
-    c.execute('''
+# Profiles almost never change, so keep them in memory between commands
+user_cache = TTLCache(maxsize=int(os.getenv('USER_CACHE_SIZE', '10000')),
+                      ttl=float(os.getenv('USER_CACHE_TTL', '300')))
+language_cache = TTLCache(maxsize=int(os.getenv('USER_CACHE_SIZE', '10000')),
+                          ttl=float(os.getenv('USER_CACHE_TTL', '300')))
+# Writes in any bot process drop these entries everywhere through the change feed
+changefeed.register('user', user_cache, language_cache)
+
+
+def _store_user(conn, user_id, email, password, address, private_key, recovery_code, language):
+    conn.execute('''
     INSERT INTO users (user_id, email, password, address, private_key, recovery_code, language)
     VALUES (?, ?, ?, ?, ?, ?, ?)
     ''', (user_id, email, password, address, private_key, recovery_code, language))
-    conn.commit()
-    conn.close()
+    changefeed.publish(conn, 'user', user_id)
 
 
-def get_user_info(user_id):
-    conn = sqlite3.connect('migrations/users.db')
-    c = conn.cursor()
-    c.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-    user_info = c.fetchone()
-    conn.close()
+async def store_user_info(user_id, email, password, address, private_key, recovery_code, language):
+    await db.write(_store_user, user_id, email, password, address, private_key, recovery_code, language)
+
+
+async def get_user_info(user_id):
+    user_id = str(user_id)
+    user_info = user_cache.get(user_id, MISSING)
+    if user_info is MISSING:
+        since = user_cache.clock
+        user_info = await db.fetchone('''
+        SELECT user_id, email, password, address, private_key, recovery_code, language FROM users WHERE user_id = ?
+        ''', (user_id,))
+        # Same guard as accounts.get_snapshot: a row read before a concurrent write committed is not cached
+        user_cache.set(user_id, user_info, since)
     return user_info
 
 
-def store_pending_purchase(user_id, amount, crypto, total_price, method, payment_link):
-    conn = sqlite3.connect('migrations/users.db')
+async def get_language(user_id):
+    # Only the language column, cached on its own so handlers that just need it skip the profile
+    user_id = str(user_id)
+    language = language_cache.get(user_id)
+    if language is None:
+        since = language_cache.clock
+        row = await db.fetchone('SELECT language FROM users WHERE user_id = ?', (user_id,))
+        language = row[0] if row else i18n.DEFAULT_LANGUAGE
+        language_cache.set(user_id, language, since)
+    return language
+
+
+def _delete_account(conn, user_id):
     c = conn.cursor()
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS pending_purchases (
-        user_id TEXT,
-        amount REAL,
-        crypto TEXT,
-        total_price REAL,
-        method TEXT,
-        payment_link TEXT,
-        status TEXT DEFAULT 'pending'
-    )
-    ''')
-    c.execute('''
-    INSERT INTO pending_purchases (user_id, amount, crypto, total_price, method, payment_link)
-    VALUES (?, ?, ?, ?, ?, ?, 'pending')
-    ''', (user_id, amount, crypto, total_price, method, payment_link))
-    conn.commit()
-    conn.close()
+    c.execute('DELETE FROM kyc_info WHERE user_id = ?', (user_id,))
+    c.execute('DELETE FROM pending_purchases WHERE user_id = ?', (user_id,))
+    c.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
+    changefeed.publish(conn, 'user', user_id)
+
+
+async def delete_user_info(user_id):
+    # Profile, KYC record and open purchases go in one transaction
+    await db.write(_delete_account, user_id)
+
+
+async def resolve_channel(channel_id):
+    # With SHARD_IDS split across processes only the process owning the guild's shard has its channels cached;
+    # the others fetch them over REST, which works from any shard
+    return bot.get_channel(channel_id) or await bot.fetch_channel(channel_id)
 
 
 # Payment link creation functions
@@ -243,16 +215,13 @@ def create_paypal_payment_link(amount_usd):
     return f"https://paypal.me/{os.getenv('PAYPAL_ID')}/{amount_usd}"
 
 
-# Verify payment function
-def verify_payment(payment_method, payment_link):
-    # Implement the actual verification logic with respective payment provider APIs
-    # For example, use webhook data to verify the payment status
-    return True  # Placeholder, should return actual verification status
+def create_tinkoff_payment_link(amount_usd):
+    return "Tinkoff Pay link"  # Replace with actual Tinkoff Pay link generation
 
 
 # Calculate total price function
-def calculate_total_price(amount, crypto, is_xplt):
-    crypto_price = get_crypto_price(crypto)
+async def calculate_total_price(amount, crypto, is_xplt):
+    crypto_price = await get_crypto_price(crypto)
     if is_xplt:
         fee = amount * XPLT_TAKER_FEE
     else:
@@ -261,235 +230,362 @@ def calculate_total_price(amount, crypto, is_xplt):
     return total_price
 
 
-# Example get_crypto_price function
-def get_crypto_price(crypto):
-    price = cryptocompare.get_price(crypto, currency='USD')
-    if price and crypto in price:
-        return price[crypto]['USD']
-    raise ValueError(f"Unable to fetch price for {crypto}")
+async def get_crypto_price(crypto):
+    return await price_oracle.get_price(crypto)
 
 
 @bot.command(name='register')
 async def register(ctx, email: str, password: str):
     user_id = str(ctx.author.id)
-    if get_user_info(user_id):
-        await ctx.author.send(messages['en']['already_registered'])
+    if await get_user_info(user_id):
+        await ctx.author.send(i18n.t('en', 'already_registered'))
         return
 
     address, private_key = generate_wallet()
     recovery_code = secrets.token_hex(16)
     language = 'en'  # Default to English; later ask user for preferred language
-    store_user_info(user_id, email, password, address, private_key, recovery_code, language)
+    await store_user_info(user_id, email, password, address, private_key, recovery_code, language)
     await ctx.author.send(f"You have successfully registered. Your wallet address is {address}.")
 
 
 @bot.command(name='kyc')
 async def kyc_command(ctx, name: str, dob: str, id_number: str):
     user_id = str(ctx.author.id)
-    if not get_user_info(user_id):
-        await ctx.author.send(messages['en']['not_registered'])
+    account = await accounts.get_snapshot(user_id)
+    if not account:
+        await ctx.author.send(i18n.t('en', 'not_registered'))
         return
 
     if not re.match("^[A-Za-z ]+$", name):
-        await ctx.author.send(messages['en']['invalid_name'])
+        await ctx.author.send(i18n.t('en', 'invalid_name'))
         return
 
     try:
         datetime.strptime(dob, '%m/%d/%Y')
     except ValueError:
-        await ctx.author.send(messages['en']['invalid_dob'])
+        await ctx.author.send(i18n.t('en', 'invalid_dob'))
         return
 
-    if kyc.get_kyc_status(user_id) == 'Approved':
-        await ctx.author.send(messages['en']['kyc_approved'])
+    if account.kyc_status == 'Approved':
+        await ctx.author.send(i18n.t('en', 'kyc_approved'))
         return
 
-    if kyc.get_attempts(user_id) >= 3:
-        await ctx.author.send(messages['en']['kyc_attempts_exceeded'])
+    if account.kyc_attempts >= 3:
+        await ctx.author.send(i18n.t('en', 'kyc_attempts_exceeded'))
         return
 
     if not ctx.message.attachments:
-        await ctx.author.send(messages['en']['kyc_attachment_required'])
+        await ctx.author.send(i18n.t('en', 'kyc_attachment_required'))
         return
 
     attachment = ctx.message.attachments[0]
     if not any(attachment.filename.lower().endswith(ext) for ext in ['.png', '.jpg', '.jpeg']):
-        await ctx.author.send(messages['en']['kyc_invalid_file_type'])
+        await ctx.author.send(i18n.t('en', 'kyc_invalid_file_type'))
         return
 
-    os.makedirs('kyc_files', exist_ok=True)
-    file_path = f'kyc_files/{ctx.author.id}_{attachment.filename}'
-    await attachment.save(file_path)
+    try:
+        file_path = await kyc_storage.store_attachment(attachment)
+    except kyc_storage.FileTooLarge:
+        await ctx.author.send(i18n.t('en', 'kyc_file_too_large'))
+        return
+    preview = await kyc_storage.make_preview(file_path)
 
-    store_result = kyc.store_kyc_info(user_id, name, dob, id_number, file_path)
+    store_result = await kyc.store_kyc_info(user_id, name, dob, id_number, file_path)
     if store_result == 'exceeded_attempts':
-        await ctx.author.send(messages['en']['kyc_attempts_exceeded'])
+        await ctx.author.send(i18n.t('en', 'kyc_attempts_exceeded'))
     elif store_result == 'edit_limit_exceeded':
-        await ctx.author.send(messages['en']['kyc_approved'])
+        await ctx.author.send(i18n.t('en', 'kyc_approved'))
     elif store_result == 'edited':
-        await ctx.author.send(messages['en']['kyc_edited'])
-        channel = bot.get_channel(KYC_CHANNEL_ID)
-        kyc_details = messages['en']['kyc_details'].format(name, dob, id_number, "(Edited)")
-        await channel.send(messages['en']['kyc_submission'].format(ctx.author.mention, kyc_details),
-                           file=discord.File(file_path), view=KYCReviewView(user_id, kyc_details, file_path))
+        await ctx.author.send(i18n.t('en', 'kyc_edited'))
+        channel = await resolve_channel(KYC_CHANNEL_ID)
+        kyc_details = i18n.t('en', 'kyc_details', name, dob, id_number, "(Edited)")
+        await channel.send(i18n.t('en', 'kyc_submission', ctx.author.mention, kyc_details),
+                           file=discord.File(preview), view=kyc_review_components(user_id))
     else:
-        await ctx.author.send(messages['en']['kyc_submitted'])
-        channel = bot.get_channel(KYC_CHANNEL_ID)
-        kyc_details = messages['en']['kyc_details'].format(name, dob, id_number, "")
-        await channel.send(messages['en']['kyc_submission'].format(ctx.author.mention, kyc_details),
-                           file=discord.File(file_path), view=KYCReviewView(user_id, kyc_details, file_path))
-
-
-class KYCReviewView(discord.ui.View):
-    def __init__(self, user_id, kyc_details, file_path):
-        super().__init__(timeout=None)  # Ensure the view does not timeout
-        self.user_id = user_id
-        self.kyc_details = kyc_details
-        self.file_path = file_path
-
-    @discord.ui.button(label="Approve", style=discord.ButtonStyle.success)
-    async def approve(self, interaction: discord.Interaction, button: discord.ui.Button):
-        kyc.approve_kyc(self.user_id)
-        user = await bot.fetch_user(self.user_id)
-        user_info = get_user_info(self.user_id)
-        await user.send(messages[user_info[-1]]['kyc_approved_msg'])
-        await interaction.message.edit(
-            content=messages[user_info[-1]]['kyc_submission'].format(user.mention, self.kyc_details), view=None)
-
-    @discord.ui.button(label="Reject", style=discord.ButtonStyle.danger)
-    async def reject(self, interaction: discord.Interaction, button: discord.ui.Button):
-        kyc.reject_kyc(self.user_id)
-        user = await bot.fetch_user(self.user_id)
-        attempts_left = 3 - kyc.get_attempts(self.user_id)
-        user_info = get_user_info(self.user_id)
-        await user.send(messages[user_info[-1]]['kyc_rejected_msg'].format(attempts_left))
-        await interaction.message.edit(
-            content=messages[user_info[-1]]['kyc_submission'].format(user.mention, self.kyc_details), view=None)
-
-
-class KYCEditView(discord.ui.View):
+        await ctx.author.send(i18n.t('en', 'kyc_submitted'))
+        channel = await resolve_channel(KYC_CHANNEL_ID)
+        kyc_details = i18n.t('en', 'kyc_details', name, dob, id_number, "")
+        await channel.send(i18n.t('en', 'kyc_submission', ctx.author.mention, kyc_details),
+                           file=discord.File(preview), view=kyc_review_components(user_id))
+
+
+class PersistentComponents(discord.ui.View):
+    # Carries buttons to Discord without discord.py keeping a copy per message; clicks are routed by custom_id
+    # to the item classes registered in setup_hook, so memory stays flat and buttons keep working after a restart.
+    # The view is stopped before it is sent: discord.py only stores views that are not finished, and a stopped
+    # view still renders its components.
+    def __init__(self, *items):
+        super().__init__(timeout=None)
+        for item in items:
+            self.add_item(item)
+        self.stop()
+
+
+class KYCReviewButton(discord.ui.DynamicItem[discord.ui.Button],
+                      template=r'kyc-review:(?P<action>approve|reject):(?P<user_id>[0-9]+)'):
+    def __init__(self, action, user_id):
+        self.action = action
+        self.user_id = str(user_id)
+        style = discord.ButtonStyle.success if action == 'approve' else discord.ButtonStyle.danger
+        super().__init__(discord.ui.Button(label=action.capitalize(), style=style,
+                                           custom_id=f'kyc-review:{action}:{user_id}'))
+
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        return cls(match['action'], match['user_id'])
+
+    async def callback(self, interaction: discord.Interaction):
+        # Anyone who can see the submission can click, including the submitter
+        if not await is_moderator(interaction.user):
+            await interaction.response.send_message(
+                i18n.t(await get_language(interaction.user.id), 'moderators_only'), ephemeral=True)
+            return
+        if self.action == 'approve':
+            await kyc.approve_kyc(self.user_id)
+        else:
+            await kyc.reject_kyc(self.user_id)
+        # The submission is read back from the database rather than kept with the message
+        account = await accounts.get_snapshot(self.user_id)
+        if not account or account.kyc_status is None:
+            await interaction.response.edit_message(view=None)
+            return
+        user = await bot.fetch_user(int(self.user_id))
+        language = account.language
+        if self.action == 'approve':
+            await user.send(i18n.t(language, 'kyc_approved_msg'))
+        else:
+            await user.send(i18n.t(language, 'kyc_rejected_msg', 3 - account.kyc_attempts))
+        kyc_details = i18n.t('en', 'kyc_details', account.kyc_name, account.kyc_dob, account.kyc_id_number,
+                             "(Edited)" if account.kyc_edited else "")
+        await interaction.response.edit_message(
+            content=i18n.t(language, 'kyc_submission', user.mention, kyc_details), view=None)
+
+
+def kyc_review_components(user_id):
+    return PersistentComponents(KYCReviewButton('approve', user_id), KYCReviewButton('reject', user_id))
+
+
+class KYCEditButton(discord.ui.DynamicItem[discord.ui.Button], template=r'kyc-edit:(?P<user_id>[0-9]+)'):
     def __init__(self, user_id):
-        super().__init__(timeout=None)  # Ensure the view does not timeout
-        self.user_id = user_id
+        self.user_id = str(user_id)
+        super().__init__(discord.ui.Button(label="Edit", style=discord.ButtonStyle.primary,
+                                           custom_id=f'kyc-edit:{user_id}'))
 
-    @discord.ui.button(label="Edit", style=discord.ButtonStyle.primary)
-    async def edit(self, interaction: discord.Interaction, button: discord.ui.Button):
-        user_info = get_user_info(self.user_id)
-        await interaction.user.send(messages[user_info[-1]]['kyc_resubmit'])
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        return cls(match['user_id'])
 
+    async def callback(self, interaction: discord.Interaction):
+        language = await get_language(self.user_id)
+        await interaction.response.send_message(i18n.t(language, 'kyc_resubmit'))
 
-class ContactSupportView(discord.ui.View):
+
+class ContactSupportButton(discord.ui.DynamicItem[discord.ui.Button], template=r'support:contact'):
     def __init__(self):
-        super().__init__(timeout=None)
+        super().__init__(discord.ui.Button(label="Contact Support", style=discord.ButtonStyle.secondary,
+                                           custom_id='support:contact'))
 
-    @discord.ui.button(label="Contact Support", style=discord.ButtonStyle.link)
-    async def contact_support(self, interaction: discord.Interaction, button: discord.ui.Button):
-        support_channel = bot.get_channel(SUPPORT_CHANNEL_ID)
-        user_info = get_user_info(interaction.user.id)
-        await interaction.user.send(messages[user_info[-1]]['contact_support'].format(support_channel.mention))
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        return cls()
+
+    async def callback(self, interaction: discord.Interaction):
+        support_channel = await resolve_channel(SUPPORT_CHANNEL_ID)
+        language = await get_language(interaction.user.id)
+        await interaction.response.send_message(i18n.t(language, 'contact_support', support_channel.mention))
 
 
 @bot.command(name='mykyc')
 async def mykyc(ctx):
     user_id = str(ctx.author.id)
-    user_info = get_user_info(user_id)
-    kyc_info = kyc.get_kyc_info(user_id)
-    if not kyc_info:
-        await ctx.author.send(messages[user_info[-1]]['no_kyc_details'])
-        return
-
-    kyc_status = kyc_info[5]
-    attempts_left = 3 - kyc.get_attempts(user_id)
-    kyc_details = messages[user_info[-1]]['kyc_details_info'].format(kyc_info[1], kyc_info[2], kyc_info[3], kyc_status,
-                                                                     attempts_left)
-    if kyc_status == 'Approved' and kyc_info[6] < 1:
-        await ctx.author.send(kyc_details, view=KYCEditView(user_id))
+    account = await accounts.get_snapshot(user_id)
+    if not account:
+        await ctx.author.send(i18n.t('en', 'not_registered'))
+        return
+
+    language = account.language
+    if account.kyc_status is None:
+        await ctx.author.send(i18n.t(language, 'no_kyc_details'))
+        return
+
+    attempts_left = 3 - account.kyc_attempts
+    kyc_details = i18n.t(language, 'kyc_details_info', account.kyc_name, account.kyc_dob, account.kyc_id_number,
+                         account.kyc_status, attempts_left)
+    if account.kyc_status == 'Approved' and account.kyc_edited < 1:
+        await ctx.author.send(kyc_details, view=PersistentComponents(KYCEditButton(user_id)))
     elif attempts_left <= 0:
-        await ctx.author.send(kyc_details, view=ContactSupportView())
+        await ctx.author.send(kyc_details, view=PersistentComponents(ContactSupportButton()))
     else:
         await ctx.author.send(kyc_details)
 
 
+async def is_moderator(user):
+    # Dashboard buttons are clicked in DMs, where the user carries no roles; the member is looked up in the
+    # server the KYC channel belongs to, over REST when that server is on another process's shards
+    guild_id = (await resolve_channel(KYC_CHANNEL_ID)).guild.id
+    if not isinstance(user, discord.Member) or user.guild.id != guild_id:
+        guild = bot.get_guild(guild_id) or await bot.fetch_guild(guild_id)
+        try:
+            user = await guild.fetch_member(user.id)
+        except discord.NotFound:
+            return False
+    return user.get_role(MOD_ROLE_ID) is not None
+
+
 @bot.command(name='moddashboard')
 @commands.has_role(MOD_ROLE_ID)
 async def moddashboard(ctx):
-    user_id = str(ctx.author.id)
-    user_info = get_user_info(user_id)
-    await ctx.author.send(messages[user_info[-1]]['moderator_dashboard'], view=ModeratorDashboardView())
+    language = await get_language(ctx.author.id)
+    await ctx.author.send(i18n.t(language, 'moderator_dashboard'), view=PersistentComponents(
+        ModeratorDashboardButton('browse'), ModeratorDashboardButton('change-status')))
+
+
+class ModeratorDashboardButton(discord.ui.DynamicItem[discord.ui.Button],
+                                template=r'mod-dashboard:(?P<action>browse|change-status)'):
+    LABELS = {'browse': "View All KYCs", 'change-status': "Change User KYC Status"}
+
+    def __init__(self, action):
+        self.action = action
+        super().__init__(discord.ui.Button(label=self.LABELS[action], style=discord.ButtonStyle.secondary,
+                                           custom_id=f'mod-dashboard:{action}'))
+
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        return cls(match['action'])
+
+    async def callback(self, interaction: discord.Interaction):
+        language = await get_language(interaction.user.id)
+        # The buttons outlive the message they came in and are routed by custom_id alone, so the role is checked
+        # again on every click
+        if not await is_moderator(interaction.user):
+            await interaction.response.send_message(i18n.t(language, 'moderators_only'), ephemeral=True)
+            return
+        if self.action == 'browse':
+            browser = KYCBrowserView(interaction.user.id, language)
+            await browser.load()
+            await interaction.response.send_message(browser.render(), view=browser)
+        else:
+            await interaction.response.send_message(i18n.t(language, 'change_kyc_status'))
 
 
-class ModeratorDashboardView(discord.ui.View):
-    def __init__(self):
-        super().__init__(timeout=None)
+KYC_PAGE_SIZE = 10
+KYC_STATUS_FILTERS = ['All', 'Pending', 'Approved', 'Rejected']
+
 
-    @discord.ui.button(label="View All KYCs", style=discord.ButtonStyle.secondary)
-    async def view_all_kycs(self, interaction: discord.Interaction, button: discord.ui.Button):
-        kycs = kyc.get_all_kycs()
-        kyc_list = "\n".join([f"{kyc[0]}: {kyc[1]} ({kyc[5]})" for kyc in kycs])
-        user_info = get_user_info(interaction.user.id)
-        await interaction.user.send(messages[user_info[-1]]['all_kyc_submissions'].format(kyc_list))
+class KYCBrowserView(discord.ui.View):
+    # Pages through kyc_info one keyset query at a time instead of loading the whole table
+    def __init__(self, moderator_id, language, status=None):
+        super().__init__(timeout=600)
+        self.moderator_id = moderator_id
+        self.language = language
+        self.status = status
+        self.page = 1
+        self.rows = []
 
-    @discord.ui.button(label="Change User KYC Status", style=discord.ButtonStyle.secondary)
-    async def change_user_kyc_status(self, interaction: discord.Interaction, button: discord.ui.Button):
-        user_info = get_user_info(interaction.user.id)
-        await interaction.user.send(messages[user_info[-1]]['change_kyc_status'])
+    async def load(self, after=None, before=None):
+        rows, has_more = await kyc.get_kycs_page(self.status, after, before, KYC_PAGE_SIZE)
+        if before is not None:
+            has_previous, has_next = has_more, True
+        else:
+            has_previous, has_next = after is not None, has_more
+        self.rows = rows
+        self.previous_page.disabled = not has_previous
+        self.next_page.disabled = not has_next
+
+    def render(self):
+        if not self.rows:
+            return i18n.t(self.language, 'kyc_page_empty')
+        kyc_list = "\n".join(f"{user_id}: {name} ({status})" for user_id, name, status in self.rows)
+        return i18n.t(self.language, 'kyc_page', self.status or 'All', self.page, kyc_list)
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        return interaction.user.id == self.moderator_id
+
+    @discord.ui.select(placeholder="Filter by status",
+                       options=[discord.SelectOption(label=status) for status in KYC_STATUS_FILTERS])
+    async def status_filter(self, interaction: discord.Interaction, select: discord.ui.Select):
+        self.status = None if select.values[0] == 'All' else select.values[0]
+        self.page = 1
+        await self.load()
+        await interaction.response.edit_message(content=self.render(), view=self)
+
+    @discord.ui.button(label="Prev", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page -= 1
+        await self.load(before=self.rows[0][0])
+        await interaction.response.edit_message(content=self.render(), view=self)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page += 1
+        await self.load(after=self.rows[-1][0])
+        await interaction.response.edit_message(content=self.render(), view=self)
 
 
 @bot.command(name='changekyc')
 @commands.has_role(MOD_ROLE_ID)
 async def changekyc(ctx, user_id: str, status: str):
-    user_info = get_user_info(user_id)
+    language = await get_language(ctx.author.id)
     if status not in ['Approved', 'Rejected', 'Pending']:
-        await ctx.author.send(messages[user_info[-1]]['invalid_status'])
+        await ctx.author.send(i18n.t(language, 'invalid_status'))
         return
 
-    kyc.update_kyc_status(user_id, status)
-    await ctx.author.send(messages[user_info[-1]]['kyc_status_updated'].format(user_id, status))
+    await kyc.update_kyc_status(user_id, status)
+    await ctx.author.send(i18n.t(language, 'kyc_status_updated', user_id, status))
 
 
 @bot.command(name='deposit')
 async def deposit(ctx, amount: float, payment_method: str):
     user_id = str(ctx.author.id)
-    user_info = get_user_info(user_id)
+    language = await get_language(user_id)
     if payment_method not in ["cashapp", "tinkoff"]:
-        await ctx.author.send(messages[user_info[-1]]['payment_method_not_supported'])
+        await ctx.author.send(i18n.t(language, 'payment_method_not_supported'))
         return
 
-    total_price = calculate_total_price(amount, 'xplt', True)
-    if payment_method == 'cashapp':
-        payment_link = create_cashapp_payment_link(total_price)
-    elif payment_method == 'tinkoff':
-        payment_link = "Tinkoff Pay link"  # Replace with actual Tinkoff Pay link generation
-
-    await ctx.author.send(f"Please complete the payment using the following link: {payment_link}")
+    total_price = await calculate_total_price(amount, 'xplt', True)
+    fallbacks = {'cashapp': create_cashapp_payment_link, 'tinkoff': create_tinkoff_payment_link}
+    quotes = await payment_engine.create_links({payment_method: fallbacks[payment_method]}, total_price,
+                                               f"{amount} XPLT deposit")
+    if not quotes:
+        await ctx.author.send("Payment verification failed. Please try again or contact support.")
+        return
+    await purchases.store_purchase_quotes(user_id, amount, 'xplt', total_price, quotes)
 
-    store_pending_purchase(user_id, amount, 'xplt', total_price, payment_method, payment_link)
+    quote_id, payment_link, _ = quotes[payment_method]
+    await ctx.author.send(f"Please complete the payment using the following link: {payment_link} (quote {quote_id})")
 
 
 @bot.command(name='sell')
 async def sell(ctx, amount: float, currency: str):
     user_id = str(ctx.author.id)
-    user_info = get_user_info(user_id)
+    user_info = await get_user_info(user_id)
     if not user_info:
-        await ctx.author.send(messages[user_info[-1]]['not_registered'])
+        dm_outbox.send(ctx.author, i18n.t('en', 'not_registered'))
         return
 
     if currency.lower() not in ["usd", "rub"]:
-        await ctx.author.send(messages[user_info[-1]]['invalid_currency'])
+        dm_outbox.send(ctx.author, i18n.t(user_info[-1], 'invalid_currency'))
+        return
+
+    try:
+        await wallet.debit(user_id, amount, 'sell', currency.lower())
+    except wallet.InsufficientFunds:
+        dm_outbox.send(ctx.author, "Insufficient balance.")
         return
 
     if currency.lower() == 'usd':
         fee = amount * XPLT_TAKER_FEE
         net_amount = amount - fee
-        await ctx.author.send(f"Withdrawing {amount} USD with a fee of {fee} USD. You will receive {net_amount} USD.")
-        await ctx.author.send(messages[user_info[-1]]['withdraw_successful_usd'].format(net_amount))
+        dm_outbox.send(
+            ctx.author, f"Withdrawing {amount} USD with a fee of {fee} USD. You will receive {net_amount} USD.")
+        dm_outbox.send(ctx.author, i18n.t(user_info[-1], 'withdraw_successful_usd', net_amount))
     elif currency.lower() == 'rub':
         fee = amount * OTHER_TAKER_FEE
         net_amount = amount - fee
-        await ctx.author.send(f"Withdrawing {amount} RUB with a fee of {fee} RUB. You will receive {net_amount} RUB.")
-        await ctx.author.send(messages[user_info[-1]]['withdraw_successful_rub'].format(net_amount))
+        dm_outbox.send(
+            ctx.author, f"Withdrawing {amount} RUB with a fee of {fee} RUB. You will receive {net_amount} RUB.")
+        dm_outbox.send(ctx.author, i18n.t(user_info[-1], 'withdraw_successful_rub', net_amount))
 
-    wallet.update_user_balance(user_id, -amount, 'Successful')
     await ctx.message.delete()
 
 
@@ -497,253 +593,341 @@ async def sell(ctx, amount: float, currency: str):
 async def request(ctx, amount: float, user: discord.User):
     user_id = str(ctx.author.id)
     recipient_id = str(user.id)
-    user_info = get_user_info(user_id)
-    recipient_info = get_user_info(recipient_id)
+    user_info = await get_user_info(user_id)
+    recipient_info = await get_user_info(recipient_id)
     if not user_info or not recipient_info:
-        await ctx.author.send(messages[user_info[-1]]['not_registered'])
+        dm_outbox.send(ctx.author, i18n.t(await get_language(user_id), 'not_registered'))
         return
 
     sender_account = user_info[3]
     recipient_account = recipient_info[3]
-    await user.send(messages[recipient_info[-1]]['request_tokens'].format(ctx.author.mention, amount, sender_account))
-    await ctx.author.send(messages[user_info[-1]]['request_sent'].format(amount, user.mention, recipient_account))
+    dm_outbox.send(user, i18n.t(recipient_info[-1], 'request_tokens', ctx.author.mention, amount, sender_account))
+    dm_outbox.send(ctx.author, i18n.t(user_info[-1], 'request_sent', amount, user.mention, recipient_account))
 
 
 @bot.command(name='send')
 async def send(ctx, amount: float, user: discord.User):
     user_id = str(ctx.author.id)
     recipient_id = str(user.id)
-    user_info = get_user_info(user_id)
-    recipient_info = get_user_info(recipient_id)
+    user_info = await get_user_info(user_id)
+    recipient_info = await get_user_info(recipient_id)
     if not user_info or not recipient_info:
-        await ctx.author.send(messages[user_info[-1]]['not_registered'])
+        dm_outbox.send(ctx.author, i18n.t(await get_language(user_id), 'not_registered'))
         return
 
     sender_account = user_info[3]
     recipient_account = recipient_info[3]
-    wallet.update_user_balance(user_id, -amount, 'Successful')
-    wallet.update_user_balance(recipient_id, amount, 'Successful')
-    await user.send(messages[recipient_info[-1]]['send_tokens'].format(ctx.author.mention, amount))
-    await ctx.author.send(messages[user_info[-1]]['send_successful'].format(amount, user.mention))
+    try:
+        await wallet.transfer(user_id, recipient_id, amount)
+    except wallet.InsufficientFunds:
+        dm_outbox.send(ctx.author, "Insufficient balance.")
+        return
+    except wallet.UnknownUser:
+        dm_outbox.send(ctx.author, i18n.t(user_info[-1], 'not_registered'))
+        return
+    dm_outbox.send(user, i18n.t(recipient_info[-1], 'send_tokens', ctx.author.mention, amount))
+    dm_outbox.send(ctx.author, i18n.t(user_info[-1], 'send_successful', amount, user.mention))
 
 
 @bot.command(name='transfer')
 async def transfer(ctx, amount: float, address: str):
     user_id = str(ctx.author.id)
-    user_info = get_user_info(user_id)
-    amount_in_wei = Web3.toWei(amount, 'ether')
-    tx_hash = transfer_tokens(user_info[4], address, amount_in_wei)
-    await ctx.author.send(messages[user_info[-1]]['transfer_successful'].format(amount, address, tx_hash))
+    user_info = await get_user_info(user_id)
+    amount_in_wei = Web3.to_wei(amount, 'ether')
+    author = ctx.author
+    language = user_info[-1]
+
+    async def on_receipt(tx_hash, receipt):
+        if receipt is not None and receipt.get('status') == '0x1':
+            await author.send(i18n.t(language, 'transfer_confirmed', tx_hash))
+        else:
+            await author.send(i18n.t(language, 'transfer_failed', tx_hash))
+
+    tx_hash = await transfer_tokens(user_info[4], address, amount_in_wei, on_receipt)
+    await ctx.author.send(i18n.t(language, 'transfer_successful', amount, address, tx_hash))
 
 
 @bot.command(name='balance')
 async def balance(ctx):
-    user_id = str(ctx.author.id)
-    user_info = get_user_info(user_id)
-    balance = wallet.get_balance(user_id)
-    await ctx.author.send(messages[user_info[-1]]['balance_info'].format(balance))
+    account = await accounts.get_snapshot(ctx.author.id)
+    if not account:
+        await ctx.author.send(i18n.t(i18n.DEFAULT_LANGUAGE, 'balance_info', 0))
+        return
+    await ctx.author.send(i18n.t(account.language, 'balance_info', account.balance))
 
 
 @bot.command(name='dashboard')
 async def dashboard(ctx):
     user_id = str(ctx.author.id)
-    user_info = get_user_info(user_id)
-    if not user_info:
-        await ctx.author.send(messages['en']['not_registered'])
+    account = await accounts.get_snapshot(user_id)
+    if not account:
+        await ctx.author.send(i18n.t('en', 'not_registered'))
         return
-    if kyc.get_kyc_status(user_id) != 'Approved':
-        await ctx.author.send(messages[user_info[-1]]['kyc_submitted'])
+    if account.kyc_status != 'Approved':
+        await ctx.author.send(i18n.t(account.language, 'kyc_submitted'))
         return
-    balance = wallet.get_balance(user_id)
-    await ctx.author.send(messages[user_info[-1]]['dashboard_info'].format(balance, kyc.get_kyc_status(user_id)))
+    await ctx.author.send(i18n.t(account.language, 'dashboard_info', account.balance, account.kyc_status))
 
 
 @bot.command(name='accdelete')
 async def accdelete(ctx):
     user_id = str(ctx.author.id)
-    user_info = get_user_info(user_id)
-    kyc.reset_kyc(user_id)
-    conn = sqlite3.connect('migrations/users.db')
-    c = conn.cursor()
-    c.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
-    conn.commit()
-    conn.close()
-    await ctx.author.send(messages[user_info[-1]]['account_deleted'])
+    language = await get_language(user_id)
+    await delete_user_info(user_id)
+    await ctx.author.send(i18n.t(language, 'account_deleted'))
 
 
-def get_token_price():
-    total_supply = plutoken_contract.functions.totalSupply().call()
-    price = w3.fromWei(plutoken_contract.functions.balanceOf(contract_address).call(), 'ether') / total_supply
-    return price
+async def get_token_price():
+    return await token_price_cache.get_price()
 
 
 @bot.command(name='price')
 async def price(ctx):
-    user_id = str(ctx.author.id)
-    user_info = get_user_info(user_id)
-    token_price = get_token_price()
-    await ctx.author.send(messages[user_info[-1]]['token_price'].format(token_price))
+    language = await get_language(ctx.author.id)
+    token_price = await get_token_price()
+    await ctx.author.send(i18n.t(language, 'token_price', token_price))
 
 
 @bot.command(name='buy')
 async def buy(ctx, amount: float, crypto: str):
     user_id = str(ctx.author.id)
-    user_info = get_user_info(user_id)
+    user_info = await get_user_info(user_id)
     if not user_info:
-        await ctx.author.send(messages['en']['not_registered'])
+        await ctx.author.send(i18n.t('en', 'not_registered'))
         return
 
     is_xplt = crypto.lower() == 'xplt'
-    total_price = calculate_total_price(amount, crypto, is_xplt)
-
-    cashapp_link = create_cashapp_payment_link(total_price)
-    stripe_link = create_stripe_payment_link(total_price)
-    paypal_link = create_paypal_payment_link(total_price)
-
-    await ctx.author.send(f"Quotes for buying {amount} {crypto.upper()}:\n"
-                          f"CashApp: {cashapp_link}\n"
-                          f"Stripe: {stripe_link}\n"
-                          f"PayPal: {paypal_link}")
+    total_price = await calculate_total_price(amount, crypto, is_xplt)
+
+    # The quote ids exist before the links, so each provider checkout carries its quote id as the order reference
+    quotes = await payment_engine.create_links({
+        'cashapp': create_cashapp_payment_link,
+        'stripe': create_stripe_payment_link,
+        'paypal': create_paypal_payment_link,
+    }, total_price, f"{amount} {crypto.upper()}")
+    if not quotes:
+        await ctx.author.send("Payment verification failed. Please try again or contact support.")
+        return
+    await purchases.store_purchase_quotes(user_id, amount, crypto, total_price, quotes)
 
-    store_pending_purchase(user_id, amount, crypto, total_price, 'cashapp', cashapp_link)
-    store_pending_purchase(user_id, amount, crypto, total_price, 'stripe', stripe_link)
-    store_pending_purchase(user_id, amount, crypto, total_price, 'paypal', paypal_link)
+    names = {'cashapp': 'CashApp', 'stripe': 'Stripe', 'paypal': 'PayPal'}
+    lines = [f"{names[method]}: {link} (quote {quote_id})" for method, (quote_id, link, _) in quotes.items()]
+    await ctx.author.send(f"Quotes for buying {amount} {crypto.upper()}:\n" + '\n'.join(lines))
 
 
 @bot.command(name='confirm_payment')
-async def confirm_payment(ctx, payment_method: str):
+async def confirm_payment(ctx, payment_method: str, quote_id: str = None):
     user_id = str(ctx.author.id)
-    user_info = get_user_info(user_id)
+    user_info = await get_user_info(user_id)
     if not user_info:
-        await ctx.author.send(messages['en']['not_registered'])
+        await ctx.author.send(i18n.t('en', 'not_registered'))
         return
 
-    conn = sqlite3.connect('migrations/users.db')
-    c = conn.cursor()
-    c.execute('''
-    SELECT * FROM pending_purchases WHERE user_id = ? AND method = ? AND status = 'pending'
-    ''', (user_id, payment_method))
-    pending_purchase = c.fetchone()
-    conn.close()
+    quote = await purchases.get_pending_purchase(user_id, payment_method, quote_id)
 
-    if not pending_purchase:
+    if not quote:
         await ctx.author.send("No pending purchases found or already confirmed.")
         return
 
-    amount, crypto, total_price = pending_purchase[1], pending_purchase[2], pending_purchase[3]
-
-    payment_verified = verify_payment(payment_method, pending_purchase[5])  # Verify payment
+    # Paid quotes are also confirmed by verify_payments in the background; this checks one right away
+    try:
+        status = await payment_engine.check(quote)
+    except Exception as e:
+        logger.warning(f"Could not check {quote.method} payment for quote {quote.quote_id}: {e}")
+        status = payments.PENDING
 
-    @bot.command(name='confirm_payment')
-    async def confirm_payment(ctx, payment_method: str):
-        user_id = str(ctx.author.id)
-        user_info = get_user_info(user_id)
-        if not user_info:
-            await ctx.author.send(messages['en']['not_registered'])
+    if status == payments.PAID:
+        if not await purchases.complete_purchase(quote.quote_id, user_id, quote.amount):
+            await ctx.author.send("No pending purchases found or already confirmed.")
             return
+        await ctx.author.send(f"Payment confirmed. Your balance has been updated with {quote.amount} {quote.crypto}.")
+    else:
+        await ctx.author.send("Payment verification failed. Please try again or contact support.")
 
-        conn = sqlite3.connect('migrations/users.db')
-        c = conn.cursor()
-        c.execute('''
-        SELECT * FROM pending_purchases WHERE user_id = ? AND method = ? AND status = 'pending'
-        ''', (user_id, payment_method))
-        pending_purchase = c.fetchone()
-        conn.close()
 
-        if not pending_purchase:
-            await ctx.author.send("No pending purchases found or already confirmed.")
-            return
+@bot.command(name='withdraw')
+async def withdraw(ctx, amount: float, currency: str):
+    user_id = str(ctx.author.id)
+    user_info = await get_user_info(user_id)
+    if not user_info:
+        dm_outbox.send(ctx.author, i18n.t('en', 'not_registered'))
+        return
+
+    if currency.lower() not in ["usd", "rub"]:
+        dm_outbox.send(ctx.author, "Invalid currency. Only 'usd' and 'rub' are supported.")
+        return
+
+    try:
+        await wallet.debit(user_id, amount, 'withdraw', currency.lower())
+    except wallet.InsufficientFunds:
+        dm_outbox.send(ctx.author, "Insufficient balance.")
+        return
 
-        amount, crypto, total_price = pending_purchase[1], pending_purchase[2], pending_purchase[3]
+    if currency.lower() == 'usd':
+        fee = amount * OTHER_TAKER_FEE
+        net_amount = amount - fee
+        dm_outbox.send(
+            ctx.author, f"Withdrawing {amount} USD with a fee of {fee} USD. You will receive {net_amount} USD.")
+        dm_outbox.send(ctx.author, i18n.t(user_info[-1], 'withdraw_successful_usd', net_amount))
+    elif currency.lower() == 'rub':
+        fee = amount * OTHER_TAKER_FEE
+        net_amount = amount - fee
+        dm_outbox.send(
+            ctx.author, f"Withdrawing {amount} RUB with a fee of {fee} RUB. You will receive {net_amount} RUB.")
+        dm_outbox.send(ctx.author, i18n.t(user_info[-1], 'withdraw_successful_rub', net_amount))
 
-        payment_verified = verify_payment(payment_method, pending_purchase[5])  # Verify payment
 
-        if payment_verified:
-            wallet.update_user_balance(user_id, amount, 'Successful')
-            conn = sqlite3.connect('migrations/users.db')
-            c = conn.cursor()
-            c.execute("UPDATE pending_purchases SET status = 'confirmed' WHERE user_id = ? AND method = ?",
-                      (user_id, payment_method))
-            conn.commit()
-            conn.close()
-            await ctx.author.send(f"Payment confirmed. Your balance has been updated with {amount} {crypto}.")
-        else:
-            await ctx.author.send("Payment verification failed. Please try again or contact support.")
-
-    @bot.command(name='withdraw')
-    async def withdraw(ctx, amount: float, currency: str):
-        user_id = str(ctx.author.id)
-        user_info = get_user_info(user_id)
-        if not user_info:
-            await ctx.author.send(messages['en']['not_registered'])
-            return
+rate_limiter = ratelimit.RateLimiter()
 
-        if currency.lower() not in ["usd", "rub"]:
-            await ctx.author.send("Invalid currency. Only 'usd' and 'rub' are supported.")
-            return
 
-        balance = wallet.get_balance(user_id)
-        if balance < amount:
-            await ctx.author.send("Insufficient balance.")
-            return
+@bot.check
+async def rate_limit(ctx):
+    # Runs before every command; spammers are turned away before any DB, RPC or price work happens
+    retry_after = rate_limiter.hit(ctx.author.id, ctx.command.qualified_name)
+    if retry_after:
+        raise ratelimit.RateLimited(retry_after, notify=rate_limiter.should_notify(ctx.author.id))
+    return True
 
-        if currency.lower() == 'usd':
-            fee = amount * OTHER_TAKER_FEE
-            net_amount = amount - fee
-            await ctx.author.send(
-                f"Withdrawing {amount} USD with a fee of {fee} USD. You will receive {net_amount} USD.")
-            await ctx.author.send(messages[user_info[-1]]['withdraw_successful_usd'].format(net_amount))
-        elif currency.lower() == 'rub':
-            fee = amount * OTHER_TAKER_FEE
-            net_amount = amount - fee
-            await ctx.author.send(
-                f"Withdrawing {amount} RUB with a fee of {fee} RUB. You will receive {net_amount} RUB.")
-            await ctx.author.send(messages[user_info[-1]]['withdraw_successful_rub'].format(net_amount))
-
-        wallet.update_user_balance(user_id, -amount, 'Successful')
-
-    @bot.event
-    async def on_ready():
-        print(f'Logged in as {bot.user.name}')
-        print(f'Bot is ready.')
-
-    @bot.event
-    async def on_command_error(ctx, error):
-        if isinstance(error, commands.MissingRequiredArgument):
-            await ctx.send(messages['en']['missing_argument'].format(error.param.name))
-        elif isinstance(error, commands.CommandNotFound):
-            await ctx.send(messages['en']['invalid_command'])
-        else:
-            raise error
-
-    @bot.command(name='commands')
-    async def commands_list(ctx):
-        user_id = str(ctx.author.id)
-        user_info = get_user_info(user_id)
-        if user_info:
-            lang = user_info[-1]
-        else:
-            lang = 'en'
-        commands = """
-        !commands - Show this message
-        !register <email> <password> - Register an account
-        !kyc <name> <dob> <id_number> - Submit KYC
-        !deposit <amount> <payment_method> - Deposit money
-        !sell <amount> <currency> - Sell PluToken
-        !request <amount> <user> - Request PluToken from another user
-        !send <amount> <user> - Send PluToken to another user
-        !transfer <amount> <address> - Transfer PluToken to MetaMask
-        !balance - Check your PluToken balance
-        !dashboard - View your dashboard
-        !price - Check PluToken price
-        !mykyc - View your KYC status
-        !moddashboard - Moderator dashboard
-        !accdelete - Delete your account
-        !confirm_payment <payment_method> - Confirm payment
-        !withdraw <amount> <currency> - Withdraw funds
-        """
-        await ctx.send(commands)
 
-    bot.run(os.getenv('DISCORD_TOKEN'))
+@bot.before_invoke
+async def start_command_trace(ctx):
+    metrics.begin_command(ctx.command.qualified_name)
 
 
+@bot.after_invoke
+async def finish_command_trace(ctx):
+    metrics.end_command(ctx.command_failed)
+
+
+@tasks.loop(seconds=purchases.SWEEP_INTERVAL)
+async def sweep_purchases():
+    await purchases.sweep_expired()
+
+
+@tasks.loop(seconds=15)
+async def process_kyc_uploads():
+    # Uploads queued by the web app are posted for review here, where previews are built off the request path
+    channel = bot.get_channel(KYC_CHANNEL_ID)
+    if channel is None:
+        return
+    for upload_id, country, first_name, last_name, dob, file1_path, file2_path in await kyc.claim_uploads():
+        try:
+            previews = [await kyc_storage.make_preview(path) for path in (file1_path, file2_path)]
+            await channel.send(i18n.t('en', 'kyc_web_submission', upload_id, f"{first_name} {last_name}", dob, country),
+                               files=[discord.File(path) for path in previews])
+        except Exception as e:
+            logger.error(f"Could not post web KYC upload {upload_id}: {e}")
+            await kyc.set_upload_status(upload_id, 'queued')
+            continue
+        await kyc.set_upload_status(upload_id, 'posted')
+
+
+@tasks.loop(seconds=indexer.POLL_INTERVAL)
+async def index_deposits():
+    # One process follows the chain for every user; a failed round is retried from the checkpoint next time
+    try:
+        deposits = await deposit_indexer.poll()
+    except Exception as e:
+        logger.error(f"Deposit indexer round failed: {e}")
+        return
+    for tx_hash, log_index, block_number, user_id, amount in deposits:
+        try:
+            user = await bot.fetch_user(int(user_id))
+        except discord.HTTPException:
+            continue
+        dm_outbox.send(user, i18n.t(await get_language(user_id), 'deposit_received', amount, tx_hash))
+
+
+@tasks.loop(seconds=payments.POLL_INTERVAL)
+async def verify_payments():
+    # Every live quote is checked with its provider, so buyers are credited without running !confirm_payment
+    try:
+        quotes = await payment_engine.run_once()
+    except Exception as e:
+        logger.error(f"Payment verification round failed: {e}")
+        return
+    for quote in quotes:
+        try:
+            user = await bot.fetch_user(int(quote.user_id))
+        except discord.HTTPException:
+            continue
+        dm_outbox.send(user, i18n.t(await get_language(quote.user_id), 'payment_confirmed', quote.amount,
+                                    quote.crypto.upper()))
+
+
+@tasks.loop(hours=6)
+async def prune_kyc_files():
+    await kyc_storage.prune_files()
+
+
+@tasks.loop(seconds=changefeed.POLL_INTERVAL)
+async def poll_change_feed():
+    await changefeed.poll()
+
+
+@tasks.loop(minutes=10)
+async def trim_change_feed():
+    await changefeed.trim()
+
+
+metrics_runner = None
+
+
+@bot.event
+async def on_ready():
+    global metrics_runner
+    if metrics_runner is None:
+        metrics_runner = await metrics.start_server()
+    if not poll_change_feed.is_running():
+        poll_change_feed.start()
+    # Uploads are posted by whichever process has the KYC channel's guild in its shards
+    if not process_kyc_uploads.is_running():
+        process_kyc_uploads.start()
+    if PRIMARY_PROCESS:
+        for job in (sweep_purchases, prune_kyc_files, trim_change_feed, index_deposits, verify_payments):
+            if not job.is_running():
+                job.start()
+    print(f'Logged in as {bot.user.name}')
+    print(f'Bot is ready.')
+
+
+@bot.event
+async def on_command_error(ctx, error):
+    metrics.command_error(ctx.command.qualified_name if ctx.command else None, error)
+    if isinstance(error, commands.MissingRequiredArgument):
+        await ctx.send(i18n.t('en', 'missing_argument', error.param.name))
+    elif isinstance(error, commands.CommandNotFound):
+        await ctx.send(i18n.t('en', 'invalid_command'))
+    elif isinstance(error, ratelimit.RateLimited):
+        if error.notify:
+            await ctx.send(i18n.t(await get_language(ctx.author.id), 'rate_limited', math.ceil(error.retry_after)))
+    else:
+        raise error
+
+
+@bot.command(name='commands')
+async def commands_list(ctx):
+    lang = await get_language(ctx.author.id)
+    commands = """
+    !commands - Show this message
+    !register <email> <password> - Register an account
+    !kyc <name> <dob> <id_number> - Submit KYC
+    !deposit <amount> <payment_method> - Deposit money
+    !sell <amount> <currency> - Sell PluToken
+    !request <amount> <user> - Request PluToken from another user
+    !send <amount> <user> - Send PluToken to another user
+    !transfer <amount> <address> - Transfer PluToken to MetaMask
+    !balance - Check your PluToken balance
+    !dashboard - View your dashboard
+    !price - Check PluToken price
+    !mykyc - View your KYC status
+    !moddashboard - Moderator dashboard
+    !accdelete - Delete your account
+    !confirm_payment <payment_method> [quote_id] - Confirm payment
+    !withdraw <amount> <currency> - Withdraw funds
+    """
+    await ctx.send(commands)
+
+
+if __name__ == '__main__':
+    bot.run(os.getenv('DISCORD_TOKEN'))
@@ -0,0 +1,70 @@
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class TTLCache:
+    # Bounded LRU cache whose entries also expire after ttl seconds
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # Logical clock of invalidations. A loader reads clock before its query and passes it to set(), which
+        # drops the value if that key was invalidated meanwhile; other keys' invalidations do not matter.
+        self.clock = 0
+        # clock value of each key's latest invalidation, bounded like the data; evicted keys count as
+        # invalidated at _evicted_at
+        self._invalidated = OrderedDict()
+        self._evicted_at = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key, MISSING)
+        if entry is MISSING or entry[1] < time.monotonic():
+            if entry is not MISSING:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, since=None):
+        if since is not None and self._invalidated.get(key, self._evicted_at) > since:
+            return
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+        self.clock += 1
+        self._invalidated[key] = self.clock
+        self._invalidated.move_to_end(key)
+        while len(self._invalidated) > self.maxsize:
+            self._evicted_at = self._invalidated.popitem(last=False)[1]
+
+    def clear(self):
+        self._data.clear()
+        self.clock += 1
+        self._invalidated.clear()
+        self._evicted_at = self.clock
+
+    def __contains__(self, key):
+        entry = self._data.get(key, MISSING)
+        return entry is not MISSING and entry[1] >= time.monotonic()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
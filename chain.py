@@ -0,0 +1,85 @@
+import asyncio
+import contextvars
+import itertools
+import os
+import time
+
+import requests
+from web3 import Web3
+
+import metrics
+
+# How long a block number is trusted before asking the node again (mainnet blocks are ~12s)
+BLOCK_POLL_INTERVAL = float(os.getenv('BLOCK_POLL_INTERVAL', '4'))
+RPC_TIMEOUT = float(os.getenv('RPC_TIMEOUT', '10'))
+
+
+class RPCError(Exception):
+    pass
+
+
+class RPCClient:
+    # Minimal JSON-RPC client that can send several calls in one HTTP request
+    def __init__(self, url, timeout=RPC_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._ids = itertools.count(1)
+
+    def batch(self, calls):
+        payload = [{'jsonrpc': '2.0', 'id': next(self._ids), 'method': method, 'params': params}
+                   for method, params in calls]
+        operation = '+'.join(sorted({method for method, _ in calls}))
+        with metrics.timed('rpc', operation):
+            response = self.session.post(self.url, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            replies = {reply['id']: reply for reply in response.json()}
+        results = []
+        for call in payload:
+            reply = replies.get(call['id'])
+            if reply is None or 'error' in reply:
+                raise RPCError(f"{call['method']} failed: {reply.get('error') if reply else 'no reply'}")
+            results.append(reply['result'])
+        return results
+
+    def call(self, method, params):
+        return self.batch([(method, params)])[0]
+
+
+class TokenPriceCache:
+    # PluToken price, recomputed at most once per block and shared by all callers
+    def __init__(self, rpc, contract, poll_interval=BLOCK_POLL_INTERVAL):
+        self.rpc = rpc
+        self.contract = contract
+        self.poll_interval = poll_interval
+        self.block = None
+        self._price = None
+        self._checked_at = 0
+        self._refresh = None
+
+    async def get_price(self):
+        if self._price is not None and time.monotonic() - self._checked_at < self.poll_interval:
+            return self._price
+        if self._refresh is None:
+            loop = asyncio.get_running_loop()
+            self._refresh = loop.run_in_executor(None, contextvars.copy_context().run, self._update)
+            self._refresh.add_done_callback(self._clear_refresh)
+        return await asyncio.shield(self._refresh)
+
+    def _clear_refresh(self, future):
+        self._refresh = None
+
+    def _update(self):
+        block = int(self.rpc.call('eth_blockNumber', []), 16)
+        if block != self.block or self._price is None:
+            address = self.contract.address
+            block_tag = hex(block)
+            total_supply, balance = self.rpc.batch([
+                ('eth_call', [{'to': address, 'data': self.contract.encode_abi('totalSupply')}, block_tag]),
+                ('eth_call', [{'to': address, 'data': self.contract.encode_abi('balanceOf', args=[address])},
+                              block_tag]),
+            ])
+            self._price = Web3.from_wei(int(balance, 16), 'ether') / int(total_supply, 16)
+            self.block = block
+        self._checked_at = time.monotonic()
+        return self._price
@@ -0,0 +1,55 @@
+import logging
+import os
+import time
+
+import db
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = float(os.getenv('CHANGEFEED_POLL_INTERVAL', '1'))
+# Entries older than this have been seen by every live process
+RETENTION = 3600
+
+_caches = {}
+_last_id = None
+
+
+def register(name, *caches):
+    _caches.setdefault(name, []).extend(caches)
+
+
+def publish(conn, name, key):
+    # Call inside the db.write() that changes the row: other processes see it in the feed, and this
+    # process drops its entries as soon as the write commits
+    conn.execute('INSERT INTO cache_invalidations (cache, key, created_at) VALUES (?, ?, ?)',
+                 (name, str(key), time.time()))
+    db.after_commit(lambda: invalidate_local(name, key))
+
+
+def invalidate_local(name, key):
+    for cache in _caches.get(name, ()):
+        cache.invalidate(str(key))
+
+
+async def invalidate(name, key):
+    await db.write(publish, name, key)
+
+
+def _read(conn, after):
+    if after is None:
+        # A process starting up has empty caches, so only entries written from now on matter
+        return conn.execute('SELECT COALESCE(MAX(id), 0), NULL, NULL FROM cache_invalidations').fetchall()
+    return conn.execute('SELECT id, cache, key FROM cache_invalidations WHERE id > ? ORDER BY id',
+                        (after,)).fetchall()
+
+
+async def poll():
+    global _last_id
+    for entry_id, name, key in await db.run(_read, _last_id):
+        if name is not None:
+            invalidate_local(name, key)
+        _last_id = entry_id
+
+
+async def trim():
+    await db.execute('DELETE FROM cache_invalidations WHERE created_at < ?', (time.time() - RETENTION,))
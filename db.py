@@ -0,0 +1,208 @@
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import metrics
+import schema
+
+# Users, KYC, purchases and balances all live in this one database
+DB_PATH = os.getenv('DB_PATH', 'db/pluex.db')
+# Number of worker threads (and so the number of connections kept busy at once)
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '4'))
+# Seconds a writer waits for another process's write lock before "database is locked"
+BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', '30'))
+# After the first queued write, the writer waits this many seconds for others to share its commit.
+# Raising it trades write latency for fewer, larger transactions.
+GROUP_COMMIT_WINDOW = float(os.getenv('DB_GROUP_COMMIT_WINDOW', '0.002'))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv('DB_GROUP_COMMIT_MAX_BATCH', '128'))
+
+_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix='db')
+_pool = queue.LifoQueue()
+_writes = queue.Queue()
+_writer = None
+_writer_lock = threading.Lock()
+_write_state = threading.local()
+
+GROUP_COMMIT_SIZE = metrics.Histogram('pluex_db_group_commit_size', 'Writes applied per group commit.',
+                                      buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+GROUP_COMMIT_TIME = metrics.Histogram('pluex_db_group_commit_seconds', 'Time to apply and commit one group of writes.')
+
+
+def _connect():
+    directory = os.path.dirname(DB_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    # WAL lets readers in every bot process run alongside the single writer
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+@contextmanager
+def connection():
+    # Borrow a long-lived connection for one transaction and hand it back afterwards
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = _connect()
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        _pool.put(conn)
+
+
+def init_db():
+    with connection() as conn:
+        return schema.migrate(conn)
+
+
+async def _run(operation, func, *args):
+    def call():
+        with connection() as conn:
+            return func(conn, *args)
+
+    loop = asyncio.get_running_loop()
+    # Timed here rather than in the thread so queueing for a free connection counts too
+    with metrics.timed('sqlite', operation):
+        return await loop.run_in_executor(_executor, call)
+
+
+async def run(func, *args):
+    # Run func(conn, *args) on a pooled connection; meant for reads, mutations go through write()
+    return await _run(func.__name__.lstrip('_'), func, *args)
+
+
+def _collect():
+    batch = [_writes.get()]
+    if batch[0] is None:
+        return None
+    deadline = time.monotonic() + GROUP_COMMIT_WINDOW
+    while len(batch) < GROUP_COMMIT_MAX_BATCH:
+        try:
+            item = _writes.get(timeout=max(0, deadline - time.monotonic()))
+        except queue.Empty:
+            break
+        if item is None:
+            # Stop once this batch is committed
+            _writes.put(None)
+            break
+        batch.append(item)
+    return batch
+
+
+def after_commit(callback):
+    # Called from inside a write(): callback runs on the caller's event loop once that write is committed,
+    # before the caller resumes. Outside the writer it does nothing.
+    callbacks = getattr(_write_state, 'callbacks', None)
+    if callbacks is not None:
+        callbacks.append(callback)
+
+
+def _resolve(future, ok, value, callbacks):
+    for callback in callbacks:
+        callback()
+    if future.cancelled():
+        return
+    if ok:
+        future.set_result(value)
+    else:
+        future.set_exception(value)
+
+
+def _apply(conn, batch):
+    # One transaction for the whole batch; each write gets a savepoint so a failing caller only undoes its own work
+    start = time.perf_counter()
+    results = []
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        for func, args, _, _ in batch:
+            conn.execute('SAVEPOINT write')
+            _write_state.callbacks = callbacks = []
+            try:
+                results.append((True, func(conn, *args), callbacks))
+            except Exception as e:
+                conn.execute('ROLLBACK TO write')
+                results.append((False, e, []))
+            finally:
+                _write_state.callbacks = None
+            conn.execute('RELEASE write')
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        results = [(False, e, [])] * len(batch)
+    GROUP_COMMIT_SIZE.observe(len(batch))
+    GROUP_COMMIT_TIME.observe(time.perf_counter() - start)
+    for (_, _, loop, future), (ok, value, callbacks) in zip(batch, results):
+        loop.call_soon_threadsafe(_resolve, future, ok, value, callbacks)
+
+
+def _write_loop():
+    conn = _connect()
+    # With one fsync per group rather than per statement, a full sync is affordable: resolved writes are on disk
+    conn.execute('PRAGMA synchronous=FULL')
+    try:
+        while True:
+            batch = _collect()
+            if batch is None:
+                break
+            _apply(conn, batch)
+    finally:
+        conn.close()
+
+
+async def _write(operation, func, *args):
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_write_loop, name='db-writer', daemon=True)
+            _writer.start()
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    _writes.put((func, args, loop, future))
+    with metrics.timed('sqlite', operation):
+        return await future
+
+
+async def write(func, *args):
+    # Run func(conn, *args) on the single writer thread; resolves once the group it joined is committed
+    return await _write(func.__name__.lstrip('_'), func, *args)
+
+
+def _verb(sql):
+    return sql.split(None, 1)[0].lower()
+
+
+async def execute(sql, params=()):
+    return await _write(_verb(sql), lambda conn: conn.execute(sql, params).rowcount)
+
+
+async def fetchone(sql, params=()):
+    return await _run(_verb(sql), lambda conn: conn.execute(sql, params).fetchone())
+
+
+async def fetchall(sql, params=()):
+    return await _run(_verb(sql), lambda conn: conn.execute(sql, params).fetchall())
+
+
+def close_all():
+    global _writer
+    with _writer_lock:
+        if _writer is not None and _writer.is_alive():
+            _writes.put(None)
+            _writer.join()
+        _writer = None
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            break
@@ -0,0 +1,79 @@
+import json
+import logging
+import os
+import string
+
+logger = logging.getLogger(__name__)
+
+LOCALES_DIR = os.getenv('LOCALES_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locales'))
+DEFAULT_LANGUAGE = 'en'
+
+_formatter = string.Formatter()
+_catalogs = {}
+
+
+def _fields(template):
+    return [field for _, field, _, _ in _formatter.parse(template) if field is not None]
+
+
+def _read_catalogs(directory):
+    raw = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.json'):
+            with open(os.path.join(directory, name), encoding='utf-8') as file:
+                raw[name[:-len('.json')]] = json.load(file)
+    return raw
+
+
+def validate(raw):
+    # Every translation must use the same placeholders as English and contain no leftover escapes
+    reference = raw[DEFAULT_LANGUAGE]
+    errors = []
+    for language, catalog in raw.items():
+        for key, template in catalog.items():
+            if key not in reference:
+                errors.append(f"{language}.{key}: not defined in {DEFAULT_LANGUAGE}")
+                continue
+            try:
+                if _fields(template) != _fields(reference[key]):
+                    errors.append(f"{language}.{key}: placeholders differ from {DEFAULT_LANGUAGE}")
+            except ValueError as e:
+                errors.append(f"{language}.{key}: {e}")
+            if '\\' in template:
+                errors.append(f"{language}.{key}: contains a backslash, probably a broken escape")
+        missing = sorted(reference.keys() - catalog.keys())
+        if missing:
+            logger.warning(f"{language} is missing {len(missing)} messages, falling back to {DEFAULT_LANGUAGE}: "
+                           f"{', '.join(missing)}")
+    return errors
+
+
+def load(directory=LOCALES_DIR):
+    raw = _read_catalogs(directory)
+    errors = validate(raw)
+    if errors:
+        raise ValueError("Invalid message catalogs:\n" + "\n".join(errors))
+
+    # Missing keys are filled from English up front so a lookup is a single dict access
+    reference = raw[DEFAULT_LANGUAGE]
+    compiled = {}
+    for language, catalog in raw.items():
+        merged = dict(reference)
+        merged.update(catalog)
+        compiled[language] = {key: template.format for key, template in merged.items()}
+    _catalogs.clear()
+    _catalogs.update(compiled)
+    logger.info(f"Loaded message catalogs: {', '.join(sorted(_catalogs))}")
+
+
+def languages():
+    if not _catalogs:
+        load()
+    return sorted(_catalogs)
+
+
+def t(language, key, *args, **kwargs):
+    if not _catalogs:
+        load()
+    catalog = _catalogs.get(language) or _catalogs[DEFAULT_LANGUAGE]
+    return catalog[key](*args, **kwargs)
@@ -0,0 +1,126 @@
+import logging
+import os
+
+import startup  # loads .env before the modules below read their settings
+import db
+
+logger = logging.getLogger(__name__)
+
+# Databases used before everything moved into db.DB_PATH
+LEGACY_USERS_DB = 'migrations/users.db'
+LEGACY_WALLET_DB = 'db/plubot.db'
+LEGACY_KYC_DB = 'kyc.db'
+
+
+def _columns(conn, schema_name, table):
+    rows = conn.execute(f'PRAGMA {schema_name}.table_info({table})').fetchall()
+    return {row[1] for row in rows}
+
+
+def _import_users(conn):
+    columns = _columns(conn, 'legacy', 'users')
+    if columns:
+        conn.execute('''
+            INSERT OR IGNORE INTO users (user_id, email, password, address, private_key, recovery_code, language)
+            SELECT user_id, email, password, address, private_key, recovery_code, COALESCE(language, 'en')
+            FROM legacy.users
+        ''')
+    if 'user_id' in _columns(conn, 'legacy', 'pending_purchases'):
+        # Legacy rows get a quote id and a day to be confirmed in, the same way schema migrations 2 and 3
+        # upgraded them
+        conn.execute('''
+            INSERT INTO pending_purchases (quote_id, user_id, amount, crypto, total_price, method, payment_link,
+                                           status, created_at, expires_at)
+            SELECT lower(hex(randomblob(8))), user_id, amount, crypto, total_price, method, payment_link,
+                   COALESCE(status, 'pending'), CAST(strftime('%s', 'now') AS REAL),
+                   CAST(strftime('%s', 'now') AS REAL) + 86400
+            FROM legacy.pending_purchases WHERE user_id IS NOT NULL
+        ''')
+        conn.execute('UPDATE pending_purchases SET purchase_id = quote_id WHERE purchase_id IS NULL')
+
+
+def _import_wallet(conn):
+    if 'balance' not in _columns(conn, 'legacy', 'users'):
+        return
+    # plubot.db only has email, password and balance, so it never creates a profile: users without one from
+    # users.db would be left without an address or key
+    orphans = conn.execute('''
+        SELECT COUNT(*) FROM legacy.users WHERE user_id NOT IN (SELECT user_id FROM main.users)
+    ''').fetchone()[0]
+    if orphans:
+        logger.warning(f"Skipping the wallets of {orphans} users in {LEGACY_WALLET_DB} who have no profile")
+    if _columns(conn, 'legacy', 'ledger_entries'):
+        conn.execute('''
+            INSERT INTO ledger_entries (user_id, amount, kind, reference, created_at)
+            SELECT user_id, amount, kind, reference, created_at FROM legacy.ledger_entries
+            WHERE user_id IN (SELECT user_id FROM main.users)
+            ORDER BY entry_id
+        ''')
+    # Whatever the old ledger does not explain is booked as one opening entry per user
+    conn.execute('''
+        INSERT INTO ledger_entries (user_id, amount, kind, reference)
+        SELECT u.user_id, u.balance - COALESCE(SUM(l.amount), 0), 'import', 'legacy'
+        FROM legacy.users u LEFT JOIN main.ledger_entries l ON l.user_id = u.user_id
+        WHERE u.balance IS NOT NULL AND u.user_id IN (SELECT user_id FROM main.users)
+        GROUP BY u.user_id
+        HAVING u.balance - COALESCE(SUM(l.amount), 0) != 0
+    ''')
+    conn.execute('''
+        UPDATE main.users
+        SET balance = (SELECT COALESCE(balance, 0) FROM legacy.users l WHERE l.user_id = users.user_id)
+        WHERE user_id IN (SELECT user_id FROM legacy.users)
+    ''')
+    if 'edited' in _columns(conn, 'legacy', 'kyc_info'):
+        conn.execute('''
+            INSERT OR IGNORE INTO kyc_info (user_id, name, dob, id_number, file_path, status, attempts, edited)
+            SELECT user_id, name, dob, id_number, file_path, status, COALESCE(attempts, 0), COALESCE(edited, 0)
+            FROM legacy.kyc_info WHERE user_id IN (SELECT user_id FROM main.users)
+        ''')
+
+
+def _import_kyc(conn):
+    if not _columns(conn, 'legacy', 'kyc_info'):
+        return
+    # kyc.db was the copy the bot actually read and wrote, so it wins over db/plubot.db
+    conn.execute('''
+        INSERT INTO kyc_info (user_id, name, dob, id_number, file_path, status, attempts)
+        SELECT user_id, name, dob, id_number, file_path, status, COALESCE(attempts, 0) FROM legacy.kyc_info WHERE true
+        ON CONFLICT (user_id) DO UPDATE SET name = excluded.name, dob = excluded.dob, id_number = excluded.id_number,
+            file_path = excluded.file_path, status = excluded.status, attempts = excluded.attempts
+    ''')
+
+
+LEGACY_SOURCES = [
+    (LEGACY_USERS_DB, _import_users),
+    (LEGACY_WALLET_DB, _import_wallet),
+    (LEGACY_KYC_DB, _import_kyc),
+]
+
+
+def import_legacy():
+    db.init_db()
+    with db.connection() as conn:
+        for path, importer in LEGACY_SOURCES:
+            if not os.path.exists(path) or os.path.abspath(path) == os.path.abspath(db.DB_PATH):
+                continue
+            if conn.execute('SELECT 1 FROM legacy_imports WHERE source = ?', (path,)).fetchone():
+                logger.info(f"{path} was already imported, skipping")
+                continue
+            conn.execute('ATTACH DATABASE ? AS legacy', (path,))
+            try:
+                conn.execute('BEGIN')
+                try:
+                    importer(conn)
+                    conn.execute('INSERT INTO legacy_imports (source) VALUES (?)', (path,))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            finally:
+                conn.execute('DETACH DATABASE legacy')
+            logger.info(f"Imported {path} into {db.DB_PATH}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    import_legacy()
@@ -0,0 +1,196 @@
+import asyncio
+import contextvars
+import logging
+import os
+import time
+
+from web3 import Web3
+
+import startup  # loads .env before the modules below read their settings
+import chain
+import db
+import metrics
+import wallet
+
+logger = logging.getLogger(__name__)
+
+# keccak256('Transfer(address,address,uint256)')
+TRANSFER_TOPIC = '0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef'
+CHECKPOINT = 'plutoken_deposits'
+POLL_INTERVAL = float(os.getenv('INDEXER_POLL_INTERVAL', '15'))
+# Blocks this far behind the head are treated as final; anything newer could still be reorganised away
+CONFIRMATIONS = int(os.getenv('INDEXER_CONFIRMATIONS', '12'))
+# First block to scan when there is no checkpoint yet, e.g. the contract's deployment block to pick up deposits
+# made before the bot was running; unset, indexing starts at the newest confirmed block
+START_BLOCK = int(os.getenv('INDEXER_START_BLOCK')) if os.getenv('INDEXER_START_BLOCK') else None
+# A reorg rewinds at most this many blocks behind the checkpoint
+MAX_REWIND = int(os.getenv('INDEXER_MAX_REWIND', '1000'))
+# eth_getLogs block ranges grow while nodes answer and halve when they refuse or time out
+MIN_RANGE = int(os.getenv('INDEXER_MIN_RANGE', '10'))
+MAX_RANGE = int(os.getenv('INDEXER_MAX_RANGE', '5000'))
+# Shrink the range when one call returns more logs than this
+TARGET_LOGS = int(os.getenv('INDEXER_TARGET_LOGS', '2000'))
+
+DEPOSITS = metrics.Counter('pluex_chain_deposits_total', 'PluToken deposits credited from Transfer events.')
+
+
+def _topic_address(topic):
+    return '0x' + topic[-40:].lower()
+
+
+def _load_checkpoint(conn):
+    return conn.execute('SELECT block, block_hash FROM chain_checkpoints WHERE name = ?', (CHECKPOINT,)).fetchone()
+
+
+def _load_addresses(conn):
+    rows = conn.execute('SELECT address, user_id FROM users WHERE address IS NOT NULL').fetchall()
+    return {address.lower(): user_id for address, user_id in rows}
+
+
+def _save_checkpoint(conn, block, block_hash):
+    conn.execute('''
+        INSERT INTO chain_checkpoints (name, block, block_hash, updated_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT (name) DO UPDATE SET block = excluded.block, block_hash = excluded.block_hash,
+                                         updated_at = excluded.updated_at
+    ''', (CHECKPOINT, block, block_hash, time.time()))
+
+
+def _deposit_blocks(conn, block, floor):
+    return conn.execute('''
+        SELECT DISTINCT block_number, block_hash FROM chain_deposits WHERE block_number <= ? AND block_number > ?
+        ORDER BY block_number DESC
+    ''', (block, floor)).fetchall()
+
+
+def _credit(conn, deposits, block, block_hash):
+    # The whole range commits with its checkpoint, so a crash never credits a range twice or skips one
+    credited = []
+    for tx_hash, log_index, block_number, deposit_block_hash, user_id, amount in deposits:
+        c = conn.execute('''
+            INSERT OR IGNORE INTO chain_deposits (tx_hash, log_index, block_number, block_hash, user_id, amount,
+                                                  created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (tx_hash, log_index, block_number, deposit_block_hash, user_id, amount, time.time()))
+        if c.rowcount:
+            wallet.apply_entry(conn, user_id, amount, 'deposit', f'{tx_hash}:{log_index}')
+            credited.append((tx_hash, log_index, block_number, user_id, amount))
+    _save_checkpoint(conn, block, block_hash)
+    return credited
+
+
+def _rewind(conn, block):
+    # Deposits above block came from a branch that is no longer canonical; the rescan credits them again if
+    # they made it into the new one
+    rows = conn.execute('SELECT tx_hash, log_index, user_id, amount FROM chain_deposits WHERE block_number > ?',
+                        (block,)).fetchall()
+    for tx_hash, log_index, user_id, amount in rows:
+        try:
+            wallet.apply_entry(conn, user_id, -amount, 'deposit_reversal', f'{tx_hash}:{log_index}')
+        except wallet.UnknownUser:
+            # The account was deleted since, so there is no balance left to take the deposit back from
+            pass
+    conn.execute('DELETE FROM chain_deposits WHERE block_number > ?', (block,))
+    _save_checkpoint(conn, block, None)
+    return len(rows)
+
+
+class DepositIndexer:
+    # Follows PluToken Transfer events into user addresses with one eth_getLogs per block range,
+    # however many users there are
+    def __init__(self, rpc, contract_address, confirmations=CONFIRMATIONS):
+        self.rpc = rpc
+        self.contract_address = contract_address
+        self.confirmations = confirmations
+        self.range = MIN_RANGE
+
+    async def _call(self, method, params):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, contextvars.copy_context().run, self.rpc.call, method, params)
+
+    async def _block_hash(self, number):
+        block = await self._call('eth_getBlockByNumber', [hex(number), False])
+        return block['hash'] if block else None
+
+    async def _get_logs(self, start, end):
+        try:
+            logs = await self._call('eth_getLogs', [{
+                'address': self.contract_address, 'topics': [TRANSFER_TOPIC],
+                'fromBlock': hex(start), 'toBlock': hex(end),
+            }])
+        except Exception:
+            if end == start:
+                raise
+            self.range = max(1, (end - start + 1) // 2)
+            return None
+        if len(logs) > TARGET_LOGS:
+            self.range = max(1, self.range // 2)
+        elif end - start + 1 >= self.range:
+            self.range = min(self.range * 2, MAX_RANGE)
+        return logs
+
+    async def _check_reorg(self, checkpoint):
+        block, block_hash = checkpoint
+        if block_hash is None or await self._block_hash(block) == block_hash:
+            return False
+        # Only possible when a reorg is deeper than the confirmation depth. Deposits are kept up to the newest one
+        # whose block is still canonical and everything after it is scanned again, going back no further than
+        # MAX_REWIND blocks so a node on the wrong chain cannot send the indexer back to genesis
+        rewind_to = max(block - MAX_REWIND, 0)
+        for number, deposit_block_hash in await db.run(_deposit_blocks, block, rewind_to):
+            if await self._block_hash(number) == deposit_block_hash:
+                rewind_to = number
+                break
+        reversed_count = await db.write(_rewind, rewind_to)
+        logger.error(f"Block {block} is no longer canonical; rewound deposits to block {rewind_to} "
+                     f"and reversed {reversed_count} of them")
+        return True
+
+    async def poll(self):
+        # Scans every confirmed block not yet indexed and returns the deposits it credited
+        checkpoint = await db.run(_load_checkpoint)
+        if checkpoint and await self._check_reorg(checkpoint):
+            checkpoint = await db.run(_load_checkpoint)
+        head = int(await self._call('eth_blockNumber', []), 16) - self.confirmations
+        if checkpoint:
+            start = checkpoint[0] + 1
+        else:
+            start = max(head, 0) if START_BLOCK is None else START_BLOCK
+        addresses = await db.run(_load_addresses)
+        credited = []
+        while start <= head:
+            end = min(start + self.range - 1, head)
+            logs = await self._get_logs(start, end)
+            if logs is None:
+                continue
+            deposits = []
+            for log in logs:
+                if len(log['topics']) != 3 or log.get('removed'):
+                    continue
+                user_id = addresses.get(_topic_address(log['topics'][2]))
+                # Moves between two users' addresses (the transfer command) are not new money on the platform
+                if user_id is None or _topic_address(log['topics'][1]) in addresses:
+                    continue
+                amount = float(Web3.from_wei(int(log['data'], 16), 'ether'))
+                deposits.append((log['transactionHash'], int(log['logIndex'], 16), int(log['blockNumber'], 16),
+                                 log['blockHash'], user_id, amount))
+            credited += await db.write(_credit, deposits, end, await self._block_hash(end))
+            start = end + 1
+        DEPOSITS.inc(amount=len(credited))
+        return credited
+
+
+async def main():
+    # Runs the indexer on its own, e.g. against a local hardhat node:
+    # ETH_NETWORK=http://127.0.0.1:8545 INDEXER_CONFIRMATIONS=0 python indexer.py
+    logging.basicConfig(level=logging.INFO)
+    db.init_db()
+    indexer = DepositIndexer(chain.RPCClient(os.getenv('ETH_NETWORK')),
+                             Web3.to_checksum_address(os.getenv('PLUTOKEN_CONTRACT_ADDRESS')))
+    while True:
+        for tx_hash, log_index, block_number, user_id, amount in await indexer.poll():
+            logger.info(f"Credited {amount} PLT to {user_id} from {tx_hash}:{log_index} (block {block_number})")
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,90 +1,104 @@
-import sqlite3
-
-def init_db():
-    conn = sqlite3.connect('kyc.db')
-    c = conn.cursor()
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS kyc_info (
-        user_id TEXT PRIMARY KEY,
-        name TEXT,
-        dob TEXT,
-        id_number TEXT,
-        file_path TEXT,
-        status TEXT,
-        attempts INTEGER DEFAULT 0
-    )
-    ''')
-    conn.commit()
-    conn.close()
-
-def store_kyc_info(user_id, name, dob, id_number, file_path):
-    conn = sqlite3.connect('kyc.db')
-    c = conn.cursor()
-    c.execute('''
-    INSERT OR REPLACE INTO kyc_info (user_id, name, dob, id_number, file_path, status, attempts)
-    VALUES (?, ?, ?, ?, ?, 'Pending', COALESCE((SELECT attempts FROM kyc_info WHERE user_id = ?), 0))
-    ''', (user_id, name, dob, id_number, file_path, user_id))
-    conn.commit()
-    conn.close()
-
-def get_kyc_status(user_id):
-    conn = sqlite3.connect('kyc.db')
-    c = conn.cursor()
-    c.execute('SELECT status FROM kyc_info WHERE user_id = ?', (user_id,))
-    result = c.fetchone()
-    conn.close()
+import os
+import time
+
+import changefeed
+import db
+
+# An upload claimed by a bot process that then died is handed out again after this long
+UPLOAD_LEASE = float(os.getenv('KYC_UPLOAD_LEASE', '300'))
+
+def _store_kyc_info(conn, user_id, name, dob, id_number, file_path):
+    conn.execute('''
+    INSERT INTO kyc_info (user_id, name, dob, id_number, file_path, status)
+    VALUES (?, ?, ?, ?, ?, 'Pending')
+    ON CONFLICT (user_id) DO UPDATE SET name = excluded.name, dob = excluded.dob, id_number = excluded.id_number,
+        file_path = excluded.file_path, status = 'Pending'
+    ''', (user_id, name, dob, id_number, file_path))
+    changefeed.publish(conn, 'user', user_id)
+
+async def store_kyc_info(user_id, name, dob, id_number, file_path):
+    await db.write(_store_kyc_info, user_id, name, dob, id_number, file_path)
+
+async def get_kyc_status(user_id):
+    result = await db.fetchone('SELECT status FROM kyc_info WHERE user_id = ?', (user_id,))
     return result[0] if result else None
 
-def get_kyc_info(user_id):
-    conn = sqlite3.connect('kyc.db')
-    c = conn.cursor()
-    c.execute('SELECT * FROM kyc_info WHERE user_id = ?', (user_id,))
-    result = c.fetchone()
-    conn.close()
-    return result
-
-def get_attempts(user_id):
-    conn = sqlite3.connect('kyc.db')
-    c = conn.cursor()
-    c.execute('SELECT attempts FROM kyc_info WHERE user_id = ?', (user_id,))
-    result = c.fetchone()
-    conn.close()
+async def get_kyc_info(user_id):
+    return await db.fetchone('SELECT * FROM kyc_info WHERE user_id = ?', (user_id,))
+
+async def get_attempts(user_id):
+    result = await db.fetchone('SELECT attempts FROM kyc_info WHERE user_id = ?', (user_id,))
     return result[0] if result else 0
 
-def approve_kyc(user_id):
-    conn = sqlite3.connect('kyc.db')
-    c = conn.cursor()
-    c.execute('UPDATE kyc_info SET status = "Approved" WHERE user_id = ?', (user_id,))
-    conn.commit()
-    conn.close()
-
-def reject_kyc(user_id):
-    conn = sqlite3.connect('kyc.db')
-    c = conn.cursor()
-    c.execute('UPDATE kyc_info SET status = "Rejected" WHERE user_id = ?', (user_id,))
-    conn.commit()
-    conn.close()
-
-def update_kyc_status(user_id, status):
-    conn = sqlite3.connect('kyc.db')
-    c = conn.cursor()
-    c.execute('UPDATE kyc_info SET status = ? WHERE user_id = ?', (status, user_id))
-    conn.commit()
-    conn.close()
-
-def reset_kyc(user_id):
-    conn = sqlite3.connect('kyc.db')
-    c = conn.cursor()
-    c.execute('DELETE FROM kyc_info WHERE user_id = ?', (user_id,))
-    conn.commit()
-    conn.close()
-
-def get_all_kycs():
-    conn = sqlite3.connect('kyc.db')
-    c = conn.cursor()
-    c.execute('SELECT * FROM kyc_info')
-    results = c.fetchall()
-    conn.close()
-    return results
-
-init_db()
+def _set_status(conn, user_id, status):
+    conn.execute('UPDATE kyc_info SET status = ? WHERE user_id = ?', (status, user_id))
+    changefeed.publish(conn, 'user', user_id)
+
+async def approve_kyc(user_id):
+    await db.write(_set_status, user_id, 'Approved')
+
+async def reject_kyc(user_id):
+    await db.write(_set_status, user_id, 'Rejected')
+
+async def update_kyc_status(user_id, status):
+    await db.write(_set_status, user_id, status)
+
+def _reset_kyc(conn, user_id):
+    conn.execute('DELETE FROM kyc_info WHERE user_id = ?', (user_id,))
+    changefeed.publish(conn, 'user', user_id)
+
+async def reset_kyc(user_id):
+    await db.write(_reset_kyc, user_id)
+
+def _get_kycs_page(conn, status, after, before, limit):
+    # Keyset pagination over (status, user_id); fetches one extra row to tell whether more pages exist
+    conditions = []
+    params = []
+    if status:
+        conditions.append('status = ?')
+        params.append(status)
+    if before is not None:
+        conditions.append('user_id < ?')
+        params.append(before)
+        order = 'DESC'
+    else:
+        if after is not None:
+            conditions.append('user_id > ?')
+            params.append(after)
+        order = 'ASC'
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    rows = conn.execute(f'''
+    SELECT user_id, name, status FROM kyc_info {where} ORDER BY user_id {order} LIMIT ?
+    ''', (*params, limit + 1)).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before is not None:
+        rows.reverse()
+    return rows, has_more
+
+async def get_kycs_page(status=None, after=None, before=None, limit=10):
+    # Returns (rows, has_more); has_more refers to the direction being paged in
+    return await db.run(_get_kycs_page, status, after, before, limit)
+
+def queue_upload(conn, country, first_name, last_name, dob, file1_path, file2_path):
+    # Called by the web app inside its own transaction; the bot picks the row up with claim_uploads
+    return conn.execute('''
+    INSERT INTO kyc_uploads (country, first_name, last_name, dob, file1_path, file2_path, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (country, first_name, last_name, dob, file1_path, file2_path, time.time())).lastrowid
+
+def _claim_uploads(conn, now, limit):
+    # Queued uploads and ones whose lease ran out; each claim is leased until now + UPLOAD_LEASE
+    rows = conn.execute('''
+    SELECT upload_id, country, first_name, last_name, dob, file1_path, file2_path FROM kyc_uploads
+    WHERE status = 'queued' OR (status = 'processing' AND lease_until <= ?) ORDER BY upload_id LIMIT ?
+    ''', (now, limit)).fetchall()
+    conn.executemany("UPDATE kyc_uploads SET status = 'processing', lease_until = ? WHERE upload_id = ?",
+                     [(now + UPLOAD_LEASE, row[0]) for row in rows])
+    return rows
+
+async def claim_uploads(limit=20):
+    return await db.write(_claim_uploads, time.time(), limit)
+
+async def set_upload_status(upload_id, status):
+    await db.execute('UPDATE kyc_uploads SET status = ? WHERE upload_id = ?', (status, upload_id))
@@ -0,0 +1,185 @@
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import time
+import uuid
+
+import aiohttp
+from PIL import Image
+
+import db
+
+logger = logging.getLogger(__name__)
+
+KYC_STORAGE_DIR = os.getenv('KYC_STORAGE_DIR', 'kyc_files')
+MAX_KYC_FILE_SIZE = int(os.getenv('MAX_KYC_FILE_SIZE', str(10 * 1024 * 1024)))
+PREVIEW_SIZE = (1024, 1024)
+# Files younger than this are never pruned, so in-flight submissions are safe
+RETENTION_GRACE = float(os.getenv('KYC_RETENTION_GRACE', str(7 * 24 * 3600)))
+CHUNK_SIZE = 64 * 1024
+
+# Leading bytes of the file types accepted as ID scans
+MAGIC_NUMBERS = [
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'\xff\xd8\xff', '.jpg'),
+]
+
+_session = None
+
+
+class FileTooLarge(Exception):
+    pass
+
+
+def _get_session():
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60))
+    return _session
+
+
+def sniff_extension(header):
+    # File type from the content itself; the name and Content-Type of an upload are client-controlled
+    for magic, extension in MAGIC_NUMBERS:
+        if header.startswith(magic):
+            return extension
+    return None
+
+
+def content_path(digest, extension):
+    return os.path.join(KYC_STORAGE_DIR, digest[:2], digest + extension)
+
+
+def preview_path(file_path):
+    return os.path.splitext(file_path)[0] + '.preview.jpg'
+
+
+def _write_chunk(file, digest, chunk):
+    file.write(chunk)
+    digest.update(chunk)
+
+
+def _finish(temp_path, digest, extension):
+    # Identical uploads hash to the same path, so a second copy is simply dropped
+    final_path = content_path(digest.hexdigest(), extension)
+    if os.path.exists(final_path):
+        os.remove(temp_path)
+    else:
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(temp_path, final_path)
+    return final_path
+
+
+def _temp_path():
+    temp_dir = os.path.join(KYC_STORAGE_DIR, 'tmp')
+    os.makedirs(temp_dir, exist_ok=True)
+    return os.path.join(temp_dir, uuid.uuid4().hex)
+
+
+def store_file(file, extension):
+    # Blocking counterpart of store_stream for the web app: copies a file object in chunks
+    temp_path = _temp_path()
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(temp_path, 'wb') as out:
+            while True:
+                chunk = file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_KYC_FILE_SIZE:
+                    raise FileTooLarge(size)
+                _write_chunk(out, digest, chunk)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return _finish(temp_path, digest, extension)
+
+
+async def store_stream(chunks, extension):
+    # Writes an async iterable of byte chunks to the store once, hashing as it goes
+    loop = asyncio.get_running_loop()
+    temp_path = _temp_path()
+    digest = hashlib.sha256()
+    size = 0
+    file = await loop.run_in_executor(None, open, temp_path, 'wb')
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > MAX_KYC_FILE_SIZE:
+                raise FileTooLarge(size)
+            await loop.run_in_executor(None, _write_chunk, file, digest, chunk)
+    except BaseException:
+        file.close()
+        os.remove(temp_path)
+        raise
+    await loop.run_in_executor(None, file.close)
+    return await loop.run_in_executor(None, _finish, temp_path, digest, extension)
+
+
+async def store_attachment(attachment):
+    if attachment.size > MAX_KYC_FILE_SIZE:
+        raise FileTooLarge(attachment.size)
+    extension = os.path.splitext(attachment.filename)[1].lower()
+    async with _get_session().get(attachment.url) as response:
+        response.raise_for_status()
+        return await store_stream(response.content.iter_chunked(CHUNK_SIZE), extension)
+
+
+def _make_preview(file_path):
+    path = preview_path(file_path)
+    if os.path.exists(path):
+        return path
+    try:
+        with Image.open(file_path) as image:
+            image.thumbnail(PREVIEW_SIZE)
+            buffer = io.BytesIO()
+            image.convert('RGB').save(buffer, 'JPEG', quality=80)
+    except OSError as e:
+        logger.warning(f"Could not build a preview for {file_path}: {e}")
+        return file_path
+    with open(path, 'wb') as file:
+        file.write(buffer.getvalue())
+    return path
+
+
+async def make_preview(file_path):
+    # Downscaled JPEG for the moderator channel; falls back to the original if it cannot be decoded
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, _make_preview, file_path)
+
+
+def _prune(keep):
+    now = time.time()
+    removed = 0
+    for root, _, files in os.walk(KYC_STORAGE_DIR):
+        for name in files:
+            path = os.path.normpath(os.path.join(root, name))
+            if path in keep or now - os.path.getmtime(path) < RETENTION_GRACE:
+                continue
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+async def prune_files():
+    # Deletes stored files no longer referenced by a live (non-rejected) KYC record or a web upload
+    rows = await db.fetchall('''
+    SELECT file_path FROM kyc_info WHERE status != 'Rejected' AND file_path IS NOT NULL
+    UNION SELECT file1_path FROM kyc_uploads UNION SELECT file2_path FROM kyc_uploads
+    ''')
+    keep = {os.path.normpath(row[0]) for row in rows}
+    keep |= {os.path.normpath(preview_path(row[0])) for row in rows}
+    loop = asyncio.get_running_loop()
+    removed = await loop.run_in_executor(None, _prune, keep)
+    if removed:
+        logger.info(f"Pruned {removed} unreferenced KYC files")
+    return removed
+
+
+async def close():
+    if _session is not None:
+        await _session.close()
@@ -0,0 +1,78 @@
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import requests
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+GATEWAY_URL = 'https://discord.com/api/v10/gateway/bot'
+# A crashed process is restarted after this many seconds, doubling on repeated crashes
+RESTART_DELAY = 5
+RESTART_DELAY_MAX = 300
+
+
+def recommended_shard_count(token):
+    response = requests.get(GATEWAY_URL, headers={'Authorization': f'Bot {token}'}, timeout=10)
+    response.raise_for_status()
+    return response.json()['shards']
+
+
+def process_env(index, processes, shard_count, metrics_port):
+    # Shards are dealt out round-robin so every process gets a similar share of guilds
+    shard_ids = range(index, shard_count, processes)
+    return dict(os.environ, SHARD_COUNT=str(shard_count), SHARD_IDS=','.join(map(str, shard_ids)),
+                PROCESS_INDEX=str(index), METRICS_PORT=str(metrics_port + index))
+
+
+def main():
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    shard_count = int(os.getenv('SHARD_COUNT') or recommended_shard_count(os.getenv('DISCORD_TOKEN')))
+    processes = min(int(os.getenv('BOT_PROCESSES') or os.cpu_count() or 1), shard_count)
+    metrics_port = int(os.getenv('METRICS_PORT', '9108'))
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.py')
+    logger.info(f"Starting {processes} bot processes for {shard_count} shards")
+
+    children = {}
+    started = {}
+    delays = {}
+
+    def spawn(index):
+        started[index] = time.monotonic()
+        children[index] = subprocess.Popen([sys.executable, script],
+                                           env=process_env(index, processes, shard_count, metrics_port))
+
+    def stop(signum, frame):
+        for child in children.values():
+            child.terminate()
+        for child in children.values():
+            child.wait()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(processes):
+        spawn(index)
+    while True:
+        time.sleep(1)
+        for index, child in list(children.items()):
+            code = child.poll()
+            if code is None:
+                continue
+            if time.monotonic() - started[index] > RESTART_DELAY_MAX:
+                # It ran fine for a while, so this is not a crash loop
+                delays.pop(index, None)
+            delay = delays.get(index, RESTART_DELAY)
+            logger.error(f"Bot process {index} exited with {code}, restarting in {delay}s")
+            time.sleep(delay)
+            delays[index] = min(delay * 2, RESTART_DELAY_MAX)
+            spawn(index)
+
+
+if __name__ == '__main__':
+    main()
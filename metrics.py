@@ -0,0 +1,190 @@
+import collections
+import contextvars
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+# Commands slower than this have their trace logged and kept for /traces
+SLOW_COMMAND_THRESHOLD = float(os.getenv('SLOW_COMMAND_THRESHOLD', '1.0'))
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_metrics = []
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = collections.defaultdict(float)
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> [count per bucket..., +Inf count, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        names = self.labels + ('le',)
+        with self._lock:
+            for labels, counts in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{_format_labels(names, labels + (bound,))} {count}')
+                lines.append(f'{self.name}_bucket{_format_labels(names, labels + ("+Inf",))} {counts[-2]}')
+                lines.append(f'{self.name}_count{_format_labels(self.labels, labels)} {counts[-2]}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labels, labels)} {counts[-1]}')
+        return lines
+
+
+COMMAND_LATENCY = Histogram('pluex_command_duration_seconds', 'Time spent running a bot command.',
+                            ('command', 'status'))
+COMMAND_ERRORS = Counter('pluex_command_errors_total', 'Commands that ended in an error.', ('command', 'error'))
+DEPENDENCY_LATENCY = Histogram('pluex_dependency_duration_seconds', 'Time spent in SQLite, RPC, price and '
+                               'Discord calls.', ('dependency', 'operation'))
+DEPENDENCY_ERRORS = Counter('pluex_dependency_errors_total', 'Failed SQLite, RPC, price and Discord calls.',
+                            ('dependency', 'operation'))
+
+
+class Span:
+    # One command invocation and the dependency calls made on its behalf
+    _ids = itertools.count(1)
+
+    def __init__(self, name):
+        self.trace_id = next(self._ids)
+        self.name = name
+        self.start = time.perf_counter()
+        self.children = []
+
+    def describe(self, duration):
+        calls = ', '.join(f'{name} +{offset * 1000:.0f}ms {elapsed * 1000:.1f}ms{" failed" if failed else ""}'
+                          for name, offset, elapsed, failed in self.children)
+        return f'trace {self.trace_id} {self.name} {duration * 1000:.1f}ms: {calls or "no dependency calls"}'
+
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+_slow_traces = collections.deque(maxlen=100)
+
+
+def begin_command(name):
+    _current_span.set(Span(name))
+
+
+def end_command(failed):
+    span = _current_span.get()
+    if span is None:
+        return
+    _current_span.set(None)
+    duration = time.perf_counter() - span.start
+    COMMAND_LATENCY.observe(duration, span.name, 'error' if failed else 'ok')
+    if duration >= SLOW_COMMAND_THRESHOLD:
+        trace = span.describe(duration)
+        _slow_traces.append(trace)
+        logger.warning(f"Slow command, {trace}")
+
+
+def command_error(command, error):
+    COMMAND_ERRORS.inc(command or 'unknown', type(error).__name__)
+
+
+@contextmanager
+def timed(dependency, operation):
+    # Works from executor threads too; the call is linked to the command if the context was copied over
+    span = _current_span.get()
+    start = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        DEPENDENCY_ERRORS.inc(dependency, operation)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        DEPENDENCY_LATENCY.observe(elapsed, dependency, operation)
+        if span is not None:
+            span.children.append((f'{dependency}.{operation}', start - span.start, elapsed, failed))
+
+
+def instrument_discord(http):
+    # Times every Discord REST call (sends, edits, deletes) by route template
+    request = http.request
+
+    async def timed_request(route, **kwargs):
+        with timed('discord', f'{route.method} {route.path}'):
+            return await request(route, **kwargs)
+
+    http.request = timed_request
+
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+async def _metrics_handler(request):
+    return web.Response(text=render(), content_type='text/plain', charset='utf-8')
+
+
+async def _traces_handler(request):
+    return web.Response(text='\n'.join(_slow_traces) + '\n', content_type='text/plain', charset='utf-8')
+
+
+async def start_server(host=METRICS_HOST, port=METRICS_PORT):
+    # Small listener inside the bot process; app.py runs separately and cannot see these numbers
+    app = web.Application()
+    app.router.add_get('/metrics', _metrics_handler)
+    app.router.add_get('/traces', _traces_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
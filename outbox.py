@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import os
+
+import discord
+
+logger = logging.getLogger(__name__)
+
+# Messages queued for the same recipient within this window go out as one DM
+COALESCE_WINDOW = float(os.getenv('DM_COALESCE_WINDOW', '0.3'))
+MAX_CONCURRENT_SENDS = int(os.getenv('DM_MAX_CONCURRENT_SENDS', '5'))
+MAX_ATTEMPTS = 5
+MESSAGE_LIMIT = 2000
+
+
+def _pack(messages, limit=MESSAGE_LIMIT):
+    # Joins queued texts into as few messages of at most `limit` characters as possible, keeping order
+    packed = []
+    current = ''
+    for message in messages:
+        while len(message) > limit:
+            if current:
+                packed.append(current)
+                current = ''
+            packed.append(message[:limit])
+            message = message[limit:]
+        if current and len(current) + 1 + len(message) > limit:
+            packed.append(current)
+            current = ''
+        current = f"{current}\n{message}" if current else message
+    if current:
+        packed.append(current)
+    return packed
+
+
+class Outbox:
+    def __init__(self, window=COALESCE_WINDOW, max_concurrent=MAX_CONCURRENT_SENDS):
+        self.window = window
+        self._queues = {}
+        self._workers = {}
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def send(self, recipient, content):
+        # Queues a DM and returns immediately; one worker per recipient delivers in order
+        self._queues.setdefault(recipient.id, []).append(content)
+        if recipient.id not in self._workers:
+            self._workers[recipient.id] = asyncio.create_task(self._drain(recipient))
+
+    async def _drain(self, recipient):
+        try:
+            await asyncio.sleep(self.window)
+            while self._queues.get(recipient.id):
+                messages = self._queues.pop(recipient.id)
+                packed = _pack(messages)
+                self.coalesced += len(messages) - len(packed)
+                for content in packed:
+                    await self._deliver(recipient, content)
+        finally:
+            del self._workers[recipient.id]
+
+    async def _deliver(self, recipient, content):
+        # discord.py already waits out per-route buckets; this covers the 429s it gives up on
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                async with self._semaphore:
+                    await recipient.send(content)
+                self.sent += 1
+                return
+            except discord.Forbidden:
+                logger.info(f"Cannot DM {recipient.id}, dropping message")
+                break
+            except discord.HTTPException as e:
+                if e.status != 429 and e.status < 500:
+                    logger.error(f"Failed to DM {recipient.id}: {e}")
+                    break
+                retry_after = float(e.response.headers.get('Retry-After', 2 ** attempt))
+                logger.warning(f"DM to {recipient.id} failed with {e.status}, retrying in {retry_after}s")
+                await asyncio.sleep(retry_after)
+        self.dropped += 1
+
+    async def flush(self):
+        while self._workers:
+            await asyncio.gather(*self._workers.values(), return_exceptions=True)
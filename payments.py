@@ -0,0 +1,322 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+
+import aiohttp
+
+import metrics
+import purchases
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = float(os.getenv('PAYMENT_POLL_INTERVAL', '20'))
+BATCH_SIZE = int(os.getenv('PAYMENT_BATCH_SIZE', '500'))
+TIMEOUT = float(os.getenv('PAYMENT_TIMEOUT', '10'))
+# Requests in flight to one provider at a time; keeps a large backlog inside the providers' rate limits
+CONCURRENCY = int(os.getenv('PAYMENT_CONCURRENCY', '8'))
+# Pooled connections shared by all providers
+CONNECTION_LIMIT = int(os.getenv('PAYMENT_CONNECTION_LIMIT', '64'))
+
+PAID = 'paid'
+PENDING = 'pending'
+FAILED = 'failed'
+
+PAYMENTS_CHECKED = metrics.Counter('pluex_payment_checks_total', 'Payment status checks by provider and outcome.',
+                                   ('provider', 'status'))
+
+
+def _cents(amount):
+    return round(amount * 100)
+
+
+# Each adapter creates the provider's checkout for a quote, with the quote_id as the merchant's order reference,
+# and returns (payment link, provider reference). check() later looks the payment up by that reference and
+# answers PAID, PENDING or FAILED.
+class StripeProvider:
+    name = 'stripe'
+
+    def __init__(self, secret_key, base_url='https://api.stripe.com', success_url='https://discord.com/channels/@me',
+                 concurrency=CONCURRENCY):
+        self.secret_key = secret_key
+        self.base_url = base_url
+        self.success_url = success_url
+        self.concurrency = concurrency
+
+    async def create_link(self, session, quote_id, total_price, description):
+        async with session.post(f'{self.base_url}/v1/checkout/sessions', data={
+            'mode': 'payment',
+            'success_url': self.success_url,
+            'client_reference_id': quote_id,
+            'metadata[quote_id]': quote_id,
+            'line_items[0][quantity]': '1',
+            'line_items[0][price_data][currency]': 'usd',
+            'line_items[0][price_data][unit_amount]': str(_cents(total_price)),
+            'line_items[0][price_data][product_data][name]': description,
+        }, headers={'Authorization': f'Bearer {self.secret_key}', 'Idempotency-Key': quote_id}) as response:
+            response.raise_for_status()
+            checkout = await response.json()
+        return checkout['url'], checkout['id']
+
+    async def check(self, session, quote):
+        async with session.get(f'{self.base_url}/v1/checkout/sessions/{quote.provider_reference}',
+                               headers={'Authorization': f'Bearer {self.secret_key}'}) as response:
+            response.raise_for_status()
+            checkout = await response.json()
+        if checkout['payment_status'] == 'paid' and checkout['amount_total'] >= _cents(quote.total_price):
+            return PAID
+        if checkout['status'] == 'expired':
+            return FAILED
+        return PENDING
+
+
+class PayPalProvider:
+    name = 'paypal'
+
+    def __init__(self, client_id, secret, base_url='https://api-m.paypal.com', concurrency=CONCURRENCY):
+        self.client_id = client_id
+        self.secret = secret
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self._token = None
+        self._token_expires = 0
+
+    async def _headers(self, session, request_id=None):
+        if self._token is None or time.monotonic() > self._token_expires:
+            async with session.post(f'{self.base_url}/v1/oauth2/token', data={'grant_type': 'client_credentials'},
+                                    auth=aiohttp.BasicAuth(self.client_id, self.secret)) as response:
+                response.raise_for_status()
+                body = await response.json()
+            self._token = body['access_token']
+            # Renewed a minute early so a check never goes out with an expiring token
+            self._token_expires = time.monotonic() + body['expires_in'] - 60
+        headers = {'Authorization': f'Bearer {self._token}'}
+        if request_id:
+            # Makes a retried create or capture a no-op on PayPal's side
+            headers['PayPal-Request-Id'] = request_id
+        return headers
+
+    async def create_link(self, session, quote_id, total_price, description):
+        async with session.post(f'{self.base_url}/v2/checkout/orders', json={
+            'intent': 'CAPTURE',
+            'purchase_units': [{'invoice_id': quote_id, 'description': description,
+                                'amount': {'currency_code': 'USD', 'value': f'{total_price:.2f}'}}],
+        }, headers=await self._headers(session, quote_id)) as response:
+            response.raise_for_status()
+            order = await response.json()
+        link = next(link['href'] for link in order['links'] if link['rel'] in ('approve', 'payer-action'))
+        return link, order['id']
+
+    async def check(self, session, quote):
+        url = f'{self.base_url}/v2/checkout/orders/{quote.provider_reference}'
+        async with session.get(url, headers=await self._headers(session)) as response:
+            response.raise_for_status()
+            order = await response.json()
+        if order['status'] == 'VOIDED':
+            return FAILED
+        # The order amount is a 2-decimal string, so it is compared in cents like the other providers
+        if _cents(float(order['purchase_units'][0]['amount']['value'])) < _cents(quote.total_price):
+            return PENDING
+        if order['status'] == 'APPROVED':
+            # The buyer has approved the order; the money only moves once we capture it
+            async with session.post(f'{url}/capture', json={},
+                                    headers=await self._headers(session, f'{quote.quote_id}-capture')) as response:
+                response.raise_for_status()
+                order = await response.json()
+        if order['status'] == 'COMPLETED':
+            return PAID
+        return PENDING
+
+
+class CashAppProvider:
+    name = 'cashapp'
+
+    def __init__(self, client_id, api_key, merchant_id, base_url='https://api.cash.app', concurrency=CONCURRENCY):
+        self.client_id = client_id
+        self.api_key = api_key
+        self.merchant_id = merchant_id
+        self.base_url = base_url
+        self.concurrency = concurrency
+
+    async def create_link(self, session, quote_id, total_price, description):
+        async with session.post(f'{self.base_url}/customer-request/v1/requests', json={
+            'idempotency_key': quote_id,
+            'request': {
+                'channel': 'ONLINE',
+                'reference_id': quote_id,
+                'actions': [{'type': 'ONE_TIME_PAYMENT', 'amount': _cents(total_price), 'currency': 'USD',
+                             'scope_id': self.merchant_id}],
+            },
+        }, headers={'Authorization': f'Client {self.client_id}'}) as response:
+            response.raise_for_status()
+            request = (await response.json())['request']
+        return request['auth_flow_triggers']['mobile_url'], request['id']
+
+    async def check(self, session, quote):
+        async with session.get(f'{self.base_url}/customer-request/v1/requests/{quote.provider_reference}',
+                               headers={'Authorization': f'Client {self.client_id}'}) as response:
+            response.raise_for_status()
+            request = (await response.json())['request']
+        if request['state'] == 'DECLINED':
+            return FAILED
+        if request['state'] != 'APPROVED':
+            return PENDING
+        # An approved request grants us the payment; the idempotency key keeps repeated checks to one charge
+        async with session.post(f'{self.base_url}/network/v1/payments', json={
+            'idempotency_key': quote.quote_id,
+            'payment': {'amount': _cents(quote.total_price), 'currency': 'USD', 'merchant_id': self.merchant_id,
+                        'grant_id': request['grants'][0]['id'], 'capture': True, 'reference_id': quote.quote_id},
+        }, headers={'Authorization': f'Client {self.client_id} {self.api_key}'}) as response:
+            response.raise_for_status()
+            payment = (await response.json())['payment']
+        if payment['status'] == 'CAPTURED':
+            return PAID
+        if payment['status'] in ('DECLINED', 'VOIDED'):
+            return FAILED
+        return PENDING
+
+
+class TinkoffProvider:
+    name = 'tinkoff'
+
+    def __init__(self, terminal_key, password, base_url='https://securepay.tinkoff.ru', concurrency=CONCURRENCY):
+        self.terminal_key = terminal_key
+        self.password = password
+        self.base_url = base_url
+        self.concurrency = concurrency
+
+    def _signed(self, params):
+        # Tinkoff signs requests with the SHA-256 of all values, ordered by key, with the password added in
+        values = dict(params, TerminalKey=self.terminal_key, Password=self.password)
+        token = hashlib.sha256(''.join(str(values[key]) for key in sorted(values)).encode()).hexdigest()
+        return dict(params, TerminalKey=self.terminal_key, Token=token)
+
+    async def _post(self, session, method, params):
+        async with session.post(f'{self.base_url}/v2/{method}', json=self._signed(params)) as response:
+            response.raise_for_status()
+            body = await response.json()
+        if not body.get('Success'):
+            raise RuntimeError(f"Tinkoff {method} failed: {body.get('Message')}")
+        return body
+
+    async def create_link(self, session, quote_id, total_price, description):
+        body = await self._post(session, 'Init', {'Amount': _cents(total_price), 'OrderId': quote_id,
+                                                  'Description': description})
+        return body['PaymentURL'], str(body['PaymentId'])
+
+    async def check(self, session, quote):
+        body = await self._post(session, 'GetState', {'PaymentId': quote.provider_reference})
+        if body['Status'] == 'CONFIRMED' and body['Amount'] >= _cents(quote.total_price):
+            return PAID
+        if body['Status'] in ('REJECTED', 'CANCELED', 'DEADLINE_EXPIRED'):
+            return FAILED
+        return PENDING
+
+
+def providers_from_env():
+    # Only methods whose credentials are configured are verified; the base URLs can point at fakes (see bench.py)
+    providers = []
+    if os.getenv('STRIPE_SECRET_KEY'):
+        providers.append(StripeProvider(os.getenv('STRIPE_SECRET_KEY'),
+                                        os.getenv('STRIPE_API_URL', 'https://api.stripe.com'),
+                                        os.getenv('STRIPE_SUCCESS_URL', 'https://discord.com/channels/@me')))
+    if os.getenv('PAYPAL_CLIENT_ID'):
+        providers.append(PayPalProvider(os.getenv('PAYPAL_CLIENT_ID'), os.getenv('PAYPAL_SECRET'),
+                                        os.getenv('PAYPAL_API_URL', 'https://api-m.paypal.com')))
+    if os.getenv('CASHAPP_API_KEY'):
+        providers.append(CashAppProvider(os.getenv('CASHAPP_CLIENT_ID'), os.getenv('CASHAPP_API_KEY'),
+                                         os.getenv('CASHAPP_MERCHANT_ID'),
+                                         os.getenv('CASHAPP_API_URL', 'https://api.cash.app')))
+    if os.getenv('TINKOFF_TERMINAL_KEY'):
+        providers.append(TinkoffProvider(os.getenv('TINKOFF_TERMINAL_KEY'), os.getenv('TINKOFF_PASSWORD'),
+                                         os.getenv('TINKOFF_API_URL', 'https://securepay.tinkoff.ru')))
+    return providers
+
+
+class VerificationEngine:
+    # Checks pending quotes against their providers in batches, many at once, and confirms the paid ones
+    def __init__(self, providers, batch_size=BATCH_SIZE):
+        self.providers = {provider.name: provider for provider in providers}
+        self.batch_size = batch_size
+        self._limits = {provider.name: asyncio.Semaphore(provider.concurrency) for provider in providers}
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=TIMEOUT),
+                                                  connector=aiohttp.TCPConnector(limit=CONNECTION_LIMIT))
+        return self._session
+
+    async def create_links(self, fallbacks, total_price, description):
+        # fallbacks maps each payment method to offer to a function building a plain link, used when the method has
+        # no configured provider (such quotes are never confirmed automatically). Returns
+        # {method: (quote_id, link, provider_reference)}; a method whose provider fails is left out.
+        quote_ids = {method: purchases.new_quote_id() for method in fallbacks}
+
+        async def create(method):
+            provider = self.providers.get(method)
+            if provider is None:
+                return fallbacks[method](total_price), None
+            async with self._limits[method]:
+                with metrics.timed('payments', f'{method}.create'):
+                    return await provider.create_link(self._get_session(), quote_ids[method], total_price,
+                                                      description)
+
+        results = await asyncio.gather(*(create(method) for method in fallbacks), return_exceptions=True)
+        quotes = {}
+        for method, result in zip(fallbacks, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Could not create a {method} checkout: {result}")
+                continue
+            quotes[method] = (quote_ids[method], *result)
+        return quotes
+
+    async def check(self, quote):
+        # PENDING for quotes without a provider checkout behind them, so nothing is confirmed unverified
+        provider = self.providers.get(quote.method)
+        if provider is None or quote.provider_reference is None:
+            return PENDING
+        async with self._limits[provider.name]:
+            with metrics.timed('payments', provider.name):
+                status = await provider.check(self._get_session(), quote)
+        PAYMENTS_CHECKED.inc(provider.name, status)
+        return status
+
+    async def _verify(self, quote):
+        try:
+            status = await self.check(quote)
+        except Exception as e:
+            logger.warning(f"Could not check {quote.method} payment for quote {quote.quote_id}: {e}")
+            return None
+        if status == PAID and await purchases.complete_purchase(quote.quote_id, quote.user_id, quote.amount):
+            return quote
+        if status == FAILED:
+            await purchases.fail_purchase(quote.quote_id)
+        return None
+
+    async def run_once(self):
+        # One pass over every live quote; returns the quotes it confirmed
+        confirmed = []
+        checking = set()
+        after = ''
+        while self.providers:
+            batch = await purchases.get_pending_batch(list(self.providers), after, self.batch_size)
+            checking.update(asyncio.ensure_future(self._verify(quote)) for quote in batch)
+            # The next batch is read while this one is still being checked, so a slow provider never leaves
+            # the others idle; at most one batch waits behind the semaphores
+            while len(checking) > self.batch_size:
+                done, checking = await asyncio.wait(checking, return_when=asyncio.FIRST_COMPLETED)
+                confirmed += [task.result() for task in done if task.result() is not None]
+            if len(batch) < self.batch_size:
+                break
+            after = batch[-1].quote_id
+        if checking:
+            done, _ = await asyncio.wait(checking)
+            confirmed += [task.result() for task in done if task.result() is not None]
+        return confirmed
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import os
+import time
+
+import cryptocompare
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PRICE_TTL = float(os.getenv('PRICE_TTL', '30'))
+PRICE_REFRESH_INTERVAL = float(os.getenv('PRICE_REFRESH_INTERVAL', '10'))
+# Symbols asked for within this many seconds are kept warm by the refresher
+PRICE_HOT_WINDOW = float(os.getenv('PRICE_HOT_WINDOW', '300'))
+PRICE_BATCH_SIZE = 50
+
+
+class CryptoCompareBackend:
+    def __init__(self, api_key=None, currency='USD'):
+        if api_key:
+            cryptocompare.cryptocompare._set_api_key_parameter(api_key)
+        self.currency = currency
+
+    def fetch(self, symbols):
+        prices = cryptocompare.get_price(list(symbols), currency=self.currency) or {}
+        return {symbol: prices[symbol][self.currency] for symbol in symbols if symbol in prices}
+
+
+class StaticBackend:
+    # Fixed prices, for running the bot or benchmarks without CryptoCompare
+    def __init__(self, prices):
+        self.prices = {symbol.upper(): price for symbol, price in prices.items()}
+
+    def fetch(self, symbols):
+        return {symbol: self.prices[symbol] for symbol in symbols if symbol in self.prices}
+
+
+class PriceOracle:
+    def __init__(self, backend, ttl=PRICE_TTL, refresh_interval=PRICE_REFRESH_INTERVAL, hot_window=PRICE_HOT_WINDOW):
+        self.backend = backend
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.hot_window = hot_window
+        self._quotes = {}
+        self._last_used = {}
+        self._inflight = {}
+        self._refresher = None
+
+    def peek(self, symbol):
+        quote = self._quotes.get(symbol.upper())
+        if quote and time.monotonic() - quote[1] < self.ttl:
+            return quote[0]
+        return None
+
+    async def get_price(self, symbol):
+        symbol = symbol.upper()
+        price = self.peek(symbol)
+        self._last_used[symbol] = time.monotonic()
+        if price is not None:
+            return price
+        prices = await self.get_prices([symbol])
+        return prices[symbol]
+
+    async def get_prices(self, symbols):
+        self._ensure_refresher()
+        now = time.monotonic()
+        symbols = [symbol.upper() for symbol in symbols]
+        result = {}
+        waiting = []
+        to_fetch = []
+        for symbol in symbols:
+            self._last_used[symbol] = now
+            price = self.peek(symbol)
+            if price is not None:
+                result[symbol] = price
+            elif symbol in self._inflight:
+                waiting.append(self._inflight[symbol])
+            else:
+                to_fetch.append(symbol)
+
+        # Misses for the same symbol share one fetch; new misses go out together
+        for start in range(0, len(to_fetch), PRICE_BATCH_SIZE):
+            batch = to_fetch[start:start + PRICE_BATCH_SIZE]
+            task = asyncio.ensure_future(self._fetch(batch))
+            for symbol in batch:
+                self._inflight[symbol] = task
+            waiting.append(task)
+
+        for fetched in await asyncio.gather(*waiting):
+            result.update(fetched)
+
+        for symbol in symbols:
+            if symbol not in result:
+                raise ValueError(f"Unable to fetch price for {symbol}")
+        return {symbol: result[symbol] for symbol in symbols}
+
+    async def _fetch(self, symbols):
+        loop = asyncio.get_running_loop()
+        try:
+            with metrics.timed('prices', 'fetch'):
+                prices = await loop.run_in_executor(None, self.backend.fetch, symbols)
+        finally:
+            for symbol in symbols:
+                self._inflight.pop(symbol, None)
+        fetched_at = time.monotonic()
+        for symbol, price in prices.items():
+            self._quotes[symbol] = (price, fetched_at)
+        return prices
+
+    def _ensure_refresher(self):
+        if self._refresher is None or self._refresher.done():
+            self._refresher = asyncio.ensure_future(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            now = time.monotonic()
+            hot = [symbol for symbol, used in list(self._last_used.items()) if now - used < self.hot_window]
+            for symbol in list(self._last_used):
+                if now - self._last_used[symbol] >= self.hot_window:
+                    del self._last_used[symbol]
+                    self._quotes.pop(symbol, None)
+
+            # Re-fetch quotes that would expire before the next pass
+            stale = [symbol for symbol in hot
+                     if symbol in self._quotes and symbol not in self._inflight
+                     and now - self._quotes[symbol][1] >= self.ttl - self.refresh_interval]
+            for start in range(0, len(stale), PRICE_BATCH_SIZE):
+                try:
+                    await self._fetch(stale[start:start + PRICE_BATCH_SIZE])
+                except Exception as e:
+                    logger.warning(f"Background price refresh failed: {e}")
+
+    def close(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            self._refresher = None
@@ -0,0 +1,139 @@
+import logging
+import os
+import secrets
+import time
+from collections import namedtuple
+
+import db
+import wallet
+
+logger = logging.getLogger(__name__)
+
+# How long a payment quote can be confirmed for
+QUOTE_TTL = float(os.getenv('QUOTE_TTL', '3600'))
+# An expired quote is still checked with its provider for this long, so a payment made just before expiry that
+# settles late is credited rather than archived as 'expired'
+PAYMENT_GRACE = float(os.getenv('PURCHASE_PAYMENT_GRACE', '3600'))
+SWEEP_INTERVAL = float(os.getenv('PURCHASE_SWEEP_INTERVAL', '60'))
+SWEEP_BATCH_SIZE = int(os.getenv('PURCHASE_SWEEP_BATCH_SIZE', '500'))
+
+PendingQuote = namedtuple('PendingQuote', ['quote_id', 'user_id', 'amount', 'crypto', 'total_price', 'method',
+                                           'payment_link', 'provider_reference', 'created_at'])
+
+QUOTE_COLUMNS = ('quote_id, purchase_id, user_id, amount, crypto, total_price, method, payment_link, '
+                 'provider_reference, status, created_at, expires_at')
+
+
+def new_quote_id():
+    return secrets.token_hex(8)
+
+
+def _store_purchase_quotes(conn, purchase_id, user_id, amount, crypto, total_price, quotes):
+    now = time.time()
+    conn.executemany('''
+    INSERT INTO pending_purchases (quote_id, purchase_id, user_id, amount, crypto, total_price, method, payment_link,
+                                   provider_reference, status, created_at, expires_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'pending', ?, ?)
+    ''', [(quote_id, purchase_id, user_id, amount, crypto, total_price, method, link, reference, now, now + QUOTE_TTL)
+          for method, (quote_id, link, reference) in quotes.items()])
+
+
+async def store_purchase_quotes(user_id, amount, crypto, total_price, quotes):
+    # quotes maps payment method to (quote_id, payment_link, provider_reference), as made by
+    # payments.VerificationEngine.create_links; all quotes are written in one transaction
+    purchase_id = new_quote_id()
+    await db.write(_store_purchase_quotes, purchase_id, user_id, amount, crypto, total_price, quotes)
+    return purchase_id
+
+
+async def get_pending_purchase(user_id, method, quote_id=None):
+    # Returns the newest live quote as a PendingQuote
+    if quote_id:
+        row = await db.fetchone('''
+        SELECT quote_id, user_id, amount, crypto, total_price, method, payment_link, provider_reference, created_at
+        FROM pending_purchases
+        WHERE quote_id = ? AND user_id = ? AND method = ? AND status = 'pending' AND expires_at > ?
+        ''', (quote_id, user_id, method, time.time() - PAYMENT_GRACE))
+    else:
+        row = await db.fetchone('''
+        SELECT quote_id, user_id, amount, crypto, total_price, method, payment_link, provider_reference, created_at
+        FROM pending_purchases
+        WHERE user_id = ? AND method = ? AND status = 'pending' AND expires_at > ?
+        ORDER BY created_at DESC LIMIT 1
+        ''', (user_id, method, time.time() - PAYMENT_GRACE))
+    return PendingQuote(*row) if row else None
+
+
+async def get_pending_batch(methods, after='', limit=500):
+    # Unresolved quotes, including expired ones still within PAYMENT_GRACE, for the given methods in quote_id
+    # order; pass the last quote_id seen to get the next batch
+    placeholders = ','.join('?' * len(methods))
+    rows = await db.fetchall(f'''
+    SELECT quote_id, user_id, amount, crypto, total_price, method, payment_link, provider_reference, created_at
+    FROM pending_purchases
+    WHERE status = 'pending' AND quote_id > ? AND method IN ({placeholders}) AND provider_reference IS NOT NULL
+    AND expires_at > ?
+    ORDER BY quote_id LIMIT ?
+    ''', (after, *methods, time.time() - PAYMENT_GRACE, limit))
+    return [PendingQuote(*row) for row in rows]
+
+
+def _complete_purchase(conn, quote_id, user_id, amount):
+    c = conn.cursor()
+    c.execute("UPDATE pending_purchases SET status = 'confirmed' WHERE quote_id = ? AND status = 'pending'",
+              (quote_id,))
+    if c.rowcount != 1:
+        return False
+    # The other methods quoted for the same purchase can no longer be paid
+    c.execute('''
+    UPDATE pending_purchases SET status = 'superseded'
+    WHERE purchase_id = (SELECT purchase_id FROM pending_purchases WHERE quote_id = ?)
+    AND quote_id != ? AND status = 'pending'
+    ''', (quote_id, quote_id))
+    wallet.apply_entry(conn, user_id, amount, 'purchase', quote_id)
+    return True
+
+
+async def complete_purchase(quote_id, user_id, amount):
+    # Confirms the quote, retires its siblings and credits the buyer together; False if already resolved
+    return await db.write(_complete_purchase, quote_id, user_id, amount)
+
+
+async def fail_purchase(quote_id):
+    # The provider declined or cancelled the payment; False if the quote was already resolved
+    return await db.execute("UPDATE pending_purchases SET status = 'failed' WHERE quote_id = ? AND status = 'pending'",
+                            (quote_id,)) == 1
+
+
+def _sweep_batch(conn, now, limit):
+    c = conn.cursor()
+    # Resolved quotes go as soon as they expire, unresolved ones once the payment verifier has given up on them
+    c.execute('''
+    SELECT quote_id FROM pending_purchases WHERE expires_at <= ? AND (status != 'pending' OR expires_at <= ?) LIMIT ?
+    ''', (now, now - PAYMENT_GRACE, limit))
+    quote_ids = [row[0] for row in c.fetchall()]
+    if not quote_ids:
+        return 0
+    placeholders = ','.join('?' * len(quote_ids))
+    c.execute(f'''
+    INSERT OR REPLACE INTO pending_purchases_archive ({QUOTE_COLUMNS}, archived_at)
+    SELECT quote_id, purchase_id, user_id, amount, crypto, total_price, method, payment_link, provider_reference,
+           CASE status WHEN 'pending' THEN 'expired' ELSE status END, created_at, expires_at, ?
+    FROM pending_purchases WHERE quote_id IN ({placeholders})
+    ''', (now, *quote_ids))
+    c.execute(f'DELETE FROM pending_purchases WHERE quote_id IN ({placeholders})', quote_ids)
+    return len(quote_ids)
+
+
+async def sweep_expired(batch_size=SWEEP_BATCH_SIZE):
+    # Each batch is its own short transaction so the sweeper never holds the write lock for long
+    now = time.time()
+    total = 0
+    while True:
+        moved = await db.write(_sweep_batch, now, batch_size)
+        total += moved
+        if moved < batch_size:
+            break
+    if total:
+        logger.info(f"Archived {total} expired purchase quotes")
+    return total
@@ -0,0 +1,96 @@
+import os
+import time
+
+from discord.ext import commands
+
+from cache import TTLCache
+
+GLOBAL_RATE = float(os.getenv('RATE_LIMIT_GLOBAL_RATE', '20'))
+GLOBAL_BURST = float(os.getenv('RATE_LIMIT_GLOBAL_BURST', '60'))
+USER_RATE = float(os.getenv('RATE_LIMIT_USER_RATE', '0.5'))
+USER_BURST = float(os.getenv('RATE_LIMIT_USER_BURST', '20'))
+COMMAND_RATE = float(os.getenv('RATE_LIMIT_COMMAND_RATE', '0.2'))
+COMMAND_BURST = float(os.getenv('RATE_LIMIT_COMMAND_BURST', '10'))
+# Only one "slow down" reply per user in this many seconds
+NOTIFY_INTERVAL = 10
+
+# Commands that hit Infura, CryptoCompare or do heavy SQLite work cost more tokens
+COMMAND_COSTS = {
+    'price': 3,
+    'transfer': 5,
+    'buy': 3,
+    'deposit': 3,
+    'kyc': 3,
+    'confirm_payment': 2,
+    'send': 2,
+    'withdraw': 2,
+    'sell': 2,
+}
+
+
+class RateLimited(commands.CheckFailure):
+    def __init__(self, retry_after, notify=True):
+        super().__init__(f"Rate limited, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+        self.notify = notify
+
+
+class TokenBucket:
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, cost, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        cost = min(cost, self.capacity)
+        if self.tokens >= cost:
+            return 0
+        return (cost - self.tokens) / self.rate
+
+    def consume(self, cost):
+        self.tokens -= min(cost, self.capacity)
+
+
+class RateLimiter:
+    def __init__(self, costs=COMMAND_COSTS, max_tracked=100000):
+        self.costs = costs
+        self.global_bucket = TokenBucket(GLOBAL_BURST, GLOBAL_RATE)
+        # An evicted bucket would have refilled anyway, so idle users cost no memory
+        idle = max(USER_BURST / USER_RATE, COMMAND_BURST / COMMAND_RATE)
+        self._user_buckets = TTLCache(maxsize=max_tracked, ttl=idle)
+        self._command_buckets = TTLCache(maxsize=max_tracked, ttl=idle)
+        self._notified = TTLCache(maxsize=max_tracked, ttl=NOTIFY_INTERVAL)
+
+    def _bucket(self, buckets, key, capacity, rate):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(capacity, rate)
+        # Re-setting refreshes the idle timer
+        buckets.set(key, bucket)
+        return bucket
+
+    def hit(self, user_id, command):
+        # Charges the user, the user's use of this command and the global bucket together.
+        # Returns 0 when allowed, otherwise the seconds to wait (nothing is charged).
+        cost = self.costs.get(command, 1)
+        now = time.monotonic()
+        buckets = [
+            self.global_bucket,
+            self._bucket(self._user_buckets, user_id, USER_BURST, USER_RATE),
+            self._bucket(self._command_buckets, (user_id, command), COMMAND_BURST, COMMAND_RATE),
+        ]
+        retry_after = max(bucket.wait_time(cost, now) for bucket in buckets)
+        if retry_after:
+            return retry_after
+        for bucket in buckets:
+            bucket.consume(cost)
+        return 0
+
+    def should_notify(self, user_id):
+        if user_id in self._notified:
+            return False
+        self._notified.set(user_id, True)
+        return True
@@ -0,0 +1,231 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Each entry moves the database one version forward; never edit an entry once released, append a new one
+MIGRATIONS = [
+    # 1: users, KYC, purchases and the balance ledger in one database
+    [
+        '''
+        CREATE TABLE users (
+            user_id TEXT PRIMARY KEY,
+            email TEXT,
+            password TEXT,
+            address TEXT,
+            private_key TEXT,
+            recovery_code TEXT,
+            language TEXT NOT NULL DEFAULT 'en',
+            balance REAL NOT NULL DEFAULT 0
+        )
+        ''',
+        'CREATE INDEX idx_users_address ON users (address)',
+        '''
+        CREATE TABLE kyc_info (
+            user_id TEXT PRIMARY KEY,
+            name TEXT,
+            dob TEXT,
+            id_number TEXT,
+            file_path TEXT,
+            status TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            edited INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE pending_purchases (
+            user_id TEXT,
+            amount REAL,
+            crypto TEXT,
+            total_price REAL,
+            method TEXT,
+            payment_link TEXT,
+            status TEXT DEFAULT 'pending'
+        )
+        ''',
+        'CREATE INDEX idx_pending_purchases_user ON pending_purchases (user_id)',
+        '''
+        CREATE TABLE ledger_entries (
+            entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            amount REAL NOT NULL,
+            kind TEXT NOT NULL,
+            reference TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX idx_ledger_entries_user ON ledger_entries (user_id, entry_id)',
+        '''
+        CREATE TABLE legacy_imports (
+            source TEXT PRIMARY KEY,
+            imported_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ],
+    # 2: addressable, expiring purchase quotes with an archive for old rows
+    [
+        '''
+        CREATE TABLE pending_purchases_new (
+            quote_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            amount REAL,
+            crypto TEXT,
+            total_price REAL,
+            method TEXT,
+            payment_link TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        ''',
+        '''
+        INSERT INTO pending_purchases_new (quote_id, user_id, amount, crypto, total_price, method, payment_link, status,
+                                           created_at, expires_at)
+        SELECT lower(hex(randomblob(8))), user_id, amount, crypto, total_price, method, payment_link,
+               COALESCE(status, 'pending'), CAST(strftime('%s', 'now') AS REAL),
+               CAST(strftime('%s', 'now') AS REAL) + 86400
+        FROM pending_purchases WHERE user_id IS NOT NULL
+        ''',
+        'DROP TABLE pending_purchases',
+        'ALTER TABLE pending_purchases_new RENAME TO pending_purchases',
+        'CREATE INDEX idx_pending_purchases_lookup ON pending_purchases (user_id, method, status, created_at)',
+        'CREATE INDEX idx_pending_purchases_expiry ON pending_purchases (expires_at)',
+        '''
+        CREATE TABLE pending_purchases_archive (
+            quote_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            amount REAL,
+            crypto TEXT,
+            total_price REAL,
+            method TEXT,
+            payment_link TEXT,
+            status TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            archived_at REAL NOT NULL
+        )
+        ''',
+        'CREATE INDEX idx_pending_purchases_archive_user ON pending_purchases_archive (user_id)',
+    ],
+    # 3: quotes offered together for one purchase share a purchase_id
+    [
+        'ALTER TABLE pending_purchases ADD COLUMN purchase_id TEXT',
+        'UPDATE pending_purchases SET purchase_id = quote_id',
+        'CREATE INDEX idx_pending_purchases_purchase ON pending_purchases (purchase_id)',
+        'ALTER TABLE pending_purchases_archive ADD COLUMN purchase_id TEXT',
+    ],
+    # 4: keyset pagination of KYC submissions by status
+    [
+        'CREATE INDEX idx_kyc_info_status ON kyc_info (status, user_id)',
+    ],
+    # 5: durable queue of outgoing webhook calls from the web app
+    [
+        '''
+        CREATE TABLE webhook_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT NOT NULL,
+            embed TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            solo INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            created_at REAL NOT NULL,
+            last_error TEXT
+        )
+        ''',
+        'CREATE INDEX idx_webhook_outbox_due ON webhook_outbox (status, next_attempt_at)',
+    ],
+    # 6: ID scans uploaded through the web app, waiting for the bot to post them for review
+    [
+        '''
+        CREATE TABLE kyc_uploads (
+            upload_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            country TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            dob TEXT,
+            file1_path TEXT NOT NULL,
+            file2_path TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            created_at REAL NOT NULL
+        )
+        ''',
+        'CREATE INDEX idx_kyc_uploads_status ON kyc_uploads (status, upload_id)',
+    ],
+    # 7: change feed used to drop cached rows in every bot process after a write
+    [
+        '''
+        CREATE TABLE cache_invalidations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cache TEXT NOT NULL,
+            key TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+        ''',
+    ],
+    # 8: on-chain deposit indexer checkpoint and the Transfer events it has credited
+    [
+        '''
+        CREATE TABLE chain_checkpoints (
+            name TEXT PRIMARY KEY,
+            block INTEGER NOT NULL,
+            block_hash TEXT,
+            updated_at REAL NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE chain_deposits (
+            tx_hash TEXT NOT NULL,
+            log_index INTEGER NOT NULL,
+            block_number INTEGER NOT NULL,
+            block_hash TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            amount REAL NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (tx_hash, log_index)
+        )
+        ''',
+        'CREATE INDEX idx_chain_deposits_block ON chain_deposits (block_number)',
+    ],
+    # 9: batched scan of pending quotes by the payment verification worker
+    [
+        'CREATE INDEX idx_pending_purchases_status ON pending_purchases (status, quote_id)',
+    ],
+    # 10: the provider's own id for the checkout or order each quote was created as
+    [
+        'ALTER TABLE pending_purchases ADD COLUMN provider_reference TEXT',
+        'ALTER TABLE pending_purchases_archive ADD COLUMN provider_reference TEXT',
+    ],
+    # 11: web KYC uploads being posted are leased, so a crashed bot's claims are picked up again
+    [
+        'ALTER TABLE kyc_uploads ADD COLUMN lease_until REAL',
+        # Claims left over from before leases existed are free to take again
+        "UPDATE kyc_uploads SET lease_until = 0 WHERE status = 'processing'",
+    ],
+]
+
+
+def get_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    # Several bot processes may start together; the version is re-read under the write lock so each
+    # migration is applied exactly once
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = get_version(conn)
+            if version >= len(MIGRATIONS):
+                conn.rollback()
+                return version
+            for statement in MIGRATIONS[version]:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version + 1}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info(f"Applied database migration {version + 1}")
@@ -0,0 +1,55 @@
+import asyncio
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+# Imported first by bot.py, so this is as close to process start as Python code gets
+PROCESS_START = time.perf_counter()
+# Project modules read their settings from the environment when imported, so every entry point (bot.py, app.py,
+# indexer.py, import_legacy.py) imports this module first and .env is loaded before any of them
+load_dotenv()
+HEALTH_CHECK_TIMEOUT = float(os.getenv('HEALTH_CHECK_TIMEOUT', '5'))
+
+
+class Startup:
+    # Times each start-up phase and records the result of each health check
+    def __init__(self):
+        self.timings = {}
+        self.health = {}
+
+    def mark(self, name):
+        # Phase that ran before this object existed, measured from process start
+        self.timings[name] = time.perf_counter() - PROCESS_START
+
+    async def phase(self, name, func, *args):
+        # Blocking set-up work runs on the default executor so independent phases overlap
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(None, func, *args)
+        finally:
+            self.timings[name] = time.perf_counter() - start
+
+    async def check(self, name, func):
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(func(), HEALTH_CHECK_TIMEOUT)
+            self.health[name] = 'ok'
+        except Exception as e:
+            self.health[name] = f'{type(e).__name__}: {e}'
+            logger.warning(f"Health check {name} failed: {self.health[name]}")
+        self.timings[f'check {name}'] = time.perf_counter() - start
+
+    @property
+    def healthy(self):
+        return all(result == 'ok' for result in self.health.values())
+
+    def log(self):
+        total = time.perf_counter() - PROCESS_START
+        phases = ', '.join(f'{name} {elapsed * 1000:.0f}ms' for name, elapsed in self.timings.items())
+        status = 'healthy' if self.healthy else 'degraded'
+        logger.info(f"Cold start took {total * 1000:.0f}ms ({status}): {phases}")
@@ -0,0 +1,162 @@
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from eth_account import Account
+
+logger = logging.getLogger(__name__)
+
+CHAIN_ID = int(os.getenv('CHAIN_ID', '1'))
+GAS_PRICE_TTL = float(os.getenv('GAS_PRICE_TTL', '15'))
+# Re-read the pending nonce from the node at least this often per address
+NONCE_RESYNC_INTERVAL = float(os.getenv('NONCE_RESYNC_INTERVAL', '60'))
+RECEIPT_POLL_INTERVAL = float(os.getenv('RECEIPT_POLL_INTERVAL', '5'))
+RECEIPT_TIMEOUT = float(os.getenv('RECEIPT_TIMEOUT', '1800'))
+
+
+class NonceManager:
+    def __init__(self, resync_interval=NONCE_RESYNC_INTERVAL):
+        self.resync_interval = resync_interval
+        self._next = {}
+        self._synced_at = {}
+        # Submitted transactions per address that have not been mined or given up on yet
+        self._outstanding = {}
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def lock(self, address):
+        with self._guard:
+            return self._locks.setdefault(address, threading.Lock())
+
+    def needs_sync(self, address):
+        synced_at = self._synced_at.get(address)
+        return synced_at is None or time.monotonic() - synced_at > self.resync_interval
+
+    def next_nonce(self, address, pending=None):
+        # Call with lock(address) held; pending is the node's pending transaction count
+        nonce = self._next.get(address, 0)
+        if pending is not None:
+            # A node count below ours means transactions were dropped and their nonces must be reused. While a
+            # submitted transaction from the address is still unmined the node may simply not have it yet, so our
+            # own count is kept then.
+            nonce = max(nonce, pending) if self._outstanding.get(address) else pending
+            self._synced_at[address] = time.monotonic()
+        return nonce
+
+    def advance(self, address, nonce):
+        self._next[address] = nonce + 1
+
+    def watch(self, address):
+        with self._guard:
+            self._outstanding[address] = self._outstanding.get(address, 0) + 1
+
+    def settle(self, address):
+        with self._guard:
+            if self._outstanding.get(address, 0) > 1:
+                self._outstanding[address] -= 1
+            else:
+                self._outstanding.pop(address, None)
+
+    def reset(self, address):
+        self._next.pop(address, None)
+        self._synced_at.pop(address, None)
+
+
+class TransferPipeline:
+    def __init__(self, rpc, chain_id=CHAIN_ID, gas_price_ttl=GAS_PRICE_TTL, workers=4):
+        self.rpc = rpc
+        self.chain_id = chain_id
+        self.gas_price_ttl = gas_price_ttl
+        self.nonces = NonceManager()
+        self._gas_price = None
+        self._gas_price_at = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tx')
+        self._watching = {}
+        self._poller = None
+
+    async def submit(self, private_key, recipient, amount, on_receipt=None):
+        # Returns the tx hash as soon as the node accepts it; on_receipt(tx_hash, receipt) runs once mined
+        loop = asyncio.get_running_loop()
+        sender, tx_hash = await loop.run_in_executor(self._executor, contextvars.copy_context().run, self._send,
+                                                     private_key, recipient, amount)
+        # Watched even without a callback: until it is mined, the node's pending count must not lower our nonce
+        self._watching[tx_hash] = (on_receipt, time.monotonic(), sender)
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.ensure_future(self._poll_receipts())
+        return tx_hash
+
+    def _send(self, private_key, recipient, amount):
+        account = Account.from_key(private_key)
+        sender = account.address
+        # Everything we need from the node goes out as one JSON-RPC batch
+        calls = [('eth_estimateGas', [{'from': sender, 'to': recipient, 'value': hex(amount)}])]
+        gas_price_index = nonce_index = None
+        if time.monotonic() - self._gas_price_at > self.gas_price_ttl:
+            gas_price_index = len(calls)
+            calls.append(('eth_gasPrice', []))
+        if self.nonces.needs_sync(sender):
+            nonce_index = len(calls)
+            calls.append(('eth_getTransactionCount', [sender, 'pending']))
+        results = self.rpc.batch(calls)
+
+        gas_estimate = int(results[0], 16)
+        if gas_price_index is not None:
+            self._gas_price = int(results[gas_price_index], 16)
+            self._gas_price_at = time.monotonic()
+        pending = int(results[nonce_index], 16) if nonce_index is not None else None
+
+        with self.nonces.lock(sender):
+            nonce = self.nonces.next_nonce(sender, pending)
+            tx = {
+                'to': recipient,
+                'value': amount,
+                'gas': gas_estimate,
+                'gasPrice': self._gas_price,
+                'nonce': nonce,
+                'chainId': self.chain_id
+            }
+            signed_tx = account.sign_transaction(tx)
+            try:
+                tx_hash = self.rpc.call('eth_sendRawTransaction', [signed_tx.raw_transaction.to_0x_hex()])
+            except Exception:
+                # Our view of the nonce may be wrong; re-read it from the node next time
+                self.nonces.reset(sender)
+                raise
+            self.nonces.advance(sender, nonce)
+            self.nonces.watch(sender)
+        return sender, tx_hash
+
+    async def _poll_receipts(self):
+        loop = asyncio.get_running_loop()
+        while self._watching:
+            await asyncio.sleep(RECEIPT_POLL_INTERVAL)
+            hashes = list(self._watching)
+            try:
+                receipts = await loop.run_in_executor(
+                    self._executor, self.rpc.batch, [('eth_getTransactionReceipt', [h]) for h in hashes])
+            except Exception as e:
+                logger.warning(f"Receipt polling failed: {e}")
+                continue
+
+            now = time.monotonic()
+            for tx_hash, receipt in zip(hashes, receipts):
+                callback, submitted_at, sender = self._watching[tx_hash]
+                if receipt is None and now - submitted_at < RECEIPT_TIMEOUT:
+                    continue
+                del self._watching[tx_hash]
+                self.nonces.settle(sender)
+                if callback is None:
+                    continue
+                try:
+                    await callback(tx_hash, receipt)
+                except Exception as e:
+                    logger.error(f"Error in receipt callback for {tx_hash}: {e}")
+
+    def close(self):
+        if self._poller is not None:
+            self._poller.cancel()
+        self._executor.shutdown(wait=False)
@@ -1,85 +1,53 @@
-import sqlite3
-import os
+import changefeed
+import db
 
-# Ensure the database directory exists
-os.makedirs('db', exist_ok=True)
+class InsufficientFunds(Exception):
+    pass
 
-DB_PATH = 'db/plubot.db'
+class UnknownUser(Exception):
+    pass
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
+def apply_entry(conn, user_id, amount, kind, reference=None, check_funds=False):
+    # Usable inside another module's transaction so the balance change commits with it
     c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id TEXT PRIMARY KEY,
-            email TEXT,
-            password TEXT,
-            balance REAL DEFAULT 0
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS kyc_info (
-            user_id TEXT PRIMARY KEY,
-            name TEXT,
-            dob TEXT,
-            id_number TEXT,
-            file_path TEXT,
-            status TEXT,
-            attempts INTEGER,
-            edited INTEGER
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def create_user(user_id, email, password):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-    if c.fetchone():
-        conn.close()
-        return False
-    c.execute('INSERT INTO users (user_id, email, password) VALUES (?, ?, ?)', (user_id, email, password))
-    conn.commit()
-    conn.close()
-    return True
-
-def is_user_registered(user_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-    user = c.fetchone()
-    conn.close()
-    return bool(user)
-
-def update_user_balance(user_id, amount, status):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,))
-    balance = c.fetchone()[0]
-    if status == 'Successful':
-        new_balance = balance + amount
+    if check_funds and amount < 0:
+        c.execute('UPDATE users SET balance = balance + ? WHERE user_id = ? AND balance >= ?',
+                  (amount, user_id, -amount))
+        if c.rowcount == 0:
+            raise InsufficientFunds(user_id)
     else:
-        new_balance = balance
-    c.execute('UPDATE users SET balance = ? WHERE user_id = ?', (new_balance, user_id))
-    conn.commit()
-    conn.close()
-
-def get_balance(user_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT balance FROM users WHERE user_id = ?', (user_id,))
-    balance = c.fetchone()[0]
-    conn.close()
-    return balance
-
-def delete_user(user_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
-    c.execute('DELETE FROM kyc_info WHERE user_id = ?', (user_id,))
-    conn.commit()
-    conn.close()
-
-# Initialize the database
-init_db()
+        # Only registered users have a balance; creating the row here would leave a profile without a wallet
+        c.execute('UPDATE users SET balance = balance + ? WHERE user_id = ?', (amount, user_id))
+        if c.rowcount == 0:
+            raise UnknownUser(user_id)
+    c.execute('INSERT INTO ledger_entries (user_id, amount, kind, reference) VALUES (?, ?, ?, ?)',
+              (user_id, amount, kind, reference))
+    # Only the account snapshot carries the balance; profile and language caches stay warm
+    changefeed.publish(conn, 'balance', user_id)
+
+async def update_user_balance(user_id, amount, status, kind='adjustment', reference=None):
+    if status != 'Successful':
+        return
+    await db.write(apply_entry, user_id, amount, kind, reference)
+
+async def debit(user_id, amount, kind, reference=None):
+    # Raises InsufficientFunds instead of letting the balance go negative
+    await db.write(apply_entry, user_id, -amount, kind, reference, True)
+
+def _transfer(conn, sender_id, recipient_id, amount, reference):
+    apply_entry(conn, sender_id, -amount, 'transfer_out', reference, True)
+    apply_entry(conn, recipient_id, amount, 'transfer_in', reference)
+
+async def transfer(sender_id, recipient_id, amount, reference=None):
+    # Both legs commit together or not at all
+    await db.write(_transfer, sender_id, recipient_id, amount, reference)
+
+async def get_ledger(user_id, limit=20):
+    return await db.fetchall('''
+        SELECT entry_id, amount, kind, reference, created_at FROM ledger_entries
+        WHERE user_id = ? ORDER BY entry_id DESC LIMIT ?
+    ''', (user_id, limit))
+
+async def get_balance(user_id):
+    row = await db.fetchone('SELECT balance FROM users WHERE user_id = ?', (user_id,))
+    return row[0] if row else 0
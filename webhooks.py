@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import db
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = float(os.getenv('WEBHOOK_POLL_INTERVAL', '2'))
+MAX_ATTEMPTS = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', '8'))
+BACKOFF_BASE = 2
+BACKOFF_MAX = 600
+TIMEOUT = 10
+# Discord accepts at most 10 embeds in one webhook message
+BATCH_SIZE = 10
+# Rows being delivered are hidden from other workers (e.g. the Flask reloader's second process) this long
+LEASE = 60
+
+_wakeup = threading.Event()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def enqueue(url, embed):
+    # Stored before returning, so the submission survives a crash or a Discord outage
+    now = time.time()
+    with db.connection() as conn:
+        conn.execute('INSERT INTO webhook_outbox (url, embed, next_attempt_at, created_at) VALUES (?, ?, ?, ?)',
+                     (url, json.dumps(embed), now, now))
+    _wakeup.set()
+
+
+def _claim(now):
+    # Leases the oldest due rows for one URL; rows that failed as part of a batch go out alone
+    with db.connection() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        first = conn.execute('''
+        SELECT url, solo FROM webhook_outbox WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY id LIMIT 1
+        ''', (now,)).fetchone()
+        if first is None:
+            return None, []
+        url, solo = first
+        rows = conn.execute('''
+        SELECT id, embed, attempts FROM webhook_outbox
+        WHERE status = 'pending' AND next_attempt_at <= ? AND url = ? AND solo = ?
+        ORDER BY id LIMIT ?
+        ''', (now, url, solo, 1 if solo else BATCH_SIZE)).fetchall()
+        conn.executemany('UPDATE webhook_outbox SET next_attempt_at = ? WHERE id = ?',
+                         [(now + LEASE, row[0]) for row in rows])
+    return url, rows
+
+
+def _delete(rows):
+    with db.connection() as conn:
+        conn.executemany('DELETE FROM webhook_outbox WHERE id = ?', [(row[0],) for row in rows])
+
+
+def _reschedule(rows, error, retry_after=None):
+    # A 429 says exactly when to come back and does not count as a failed attempt
+    now = time.time()
+    updates = []
+    for row_id, _, attempts in rows:
+        if retry_after is not None:
+            updates.append((attempts, 'pending', now + retry_after, error, row_id))
+        elif attempts + 1 >= MAX_ATTEMPTS:
+            updates.append((attempts + 1, 'dead', now, error, row_id))
+        else:
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempts) * random.uniform(0.5, 1)
+            updates.append((attempts + 1, 'pending', now + delay, error, row_id))
+    with db.connection() as conn:
+        conn.executemany('UPDATE webhook_outbox SET attempts = ?, status = ?, next_attempt_at = ?, last_error = ? '
+                         'WHERE id = ?', updates)
+    dead = sum(1 for update in updates if update[1] == 'dead')
+    if dead:
+        logger.error(f"Gave up on {dead} webhook deliveries: {error}")
+
+
+def _split(rows):
+    with db.connection() as conn:
+        conn.executemany("UPDATE webhook_outbox SET solo = 1, next_attempt_at = ? WHERE id = ?",
+                         [(time.time(), row[0]) for row in rows])
+
+
+def _bury(row, error):
+    # Retrying a request Discord rejected outright would only fail again
+    with db.connection() as conn:
+        conn.execute("UPDATE webhook_outbox SET status = 'dead', attempts = attempts + 1, last_error = ? WHERE id = ?",
+                     (error, row[0]))
+    logger.error(f"Webhook rejected delivery {row[0]}: {error}")
+
+
+def _deliver(session, url, rows):
+    try:
+        response = session.post(url, json={'embeds': [json.loads(row[1]) for row in rows]}, timeout=TIMEOUT)
+    except requests.RequestException as e:
+        _reschedule(rows, str(e))
+        return
+    if response.status_code < 300:
+        _delete(rows)
+    elif response.status_code == 429:
+        _reschedule(rows, 'rate limited', float(response.headers.get('Retry-After', '1')))
+    elif response.status_code >= 500:
+        _reschedule(rows, f"HTTP {response.status_code}")
+    elif len(rows) > 1:
+        # One malformed embed should not sink the others
+        _split(rows)
+    else:
+        _bury(rows[0], f"HTTP {response.status_code}: {response.text[:200]}")
+
+
+def _run():
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+    while True:
+        _wakeup.clear()
+        try:
+            url, rows = _claim(time.time())
+            if rows:
+                _deliver(session, url, rows)
+                continue
+        except Exception as e:
+            logger.error(f"Webhook worker error: {e}")
+        _wakeup.wait(POLL_INTERVAL)
+
+
+def start_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name='webhooks', daemon=True)
+            _worker.start()